@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import random
+import shutil
+import importlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+BENCH_TOKEN = '123456:BENCH'
+ADMIN_ID = 1
+FIRST_USER_ID = 10_000
+
+def import_bot(workdir, base_url=None, mongo_uri=None, mongo_db=None):
+    """main.py ni benchmark uchun yuklaydi (data/ va exports/ workdir ichida yaratiladi)"""
+    os.environ.setdefault('BOT_TOKEN', BENCH_TOKEN)
+    os.environ['MAIN_ADMIN'] = str(ADMIN_ID)
+    os.environ.setdefault('PORT', '0')
+    # Flood control sintetik trafikni cheklamasin (har update uchun bitta javob); env orqali yoqish mumkin
+    os.environ.setdefault('FLOOD_RATE', '1000000')
+    os.environ.setdefault('FLOOD_BURST', '1000000')
+    os.environ.setdefault('FLOOD_WINDOW', '0')
+    if mongo_uri:
+        os.environ['MONGO_URI'] = mongo_uri
+    if mongo_db:
+        os.environ['MONGO_DB'] = mongo_db
+
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    bot = importlib.import_module('main')
+    if base_url:
+        bot.BASE_URL = base_url
+    return bot
+
+def remove_workdir(workdir):
+    """import_bot yaratgan vaqtinchalik katalogni o'chiradi (1M userda users.json yuzlab MB)"""
+    if os.path.abspath(os.getcwd()).startswith(os.path.abspath(workdir)):
+        os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def make_user(user_id, joined, last_active, message_count=1, username=None):
+    return {
+        'id': user_id,
+        'first_name': f"User{user_id}",
+        'last_name': random.choice(['', 'Aliyev', 'Karimov', 'Tursunov']),
+        'username': username if username is not None else (f"user{user_id}" if user_id % 3 else ''),
+        'phone': '',
+        'joined': joined,
+        'last_active': last_active,
+        'message_count': message_count,
+        'is_admin': user_id == ADMIN_ID
+    }
+
+def make_update(update_id, user_id, text, message_id=None):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': message_id or update_id,
+            'from': {'id': user_id, 'first_name': f"User{user_id}", 'username': f"user{user_id}"},
+            'chat': {'id': user_id, 'type': 'private'},
+            'date': 0,
+            'text': text
+        }
+    }
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+def write_result(result, output=None):
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
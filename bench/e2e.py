@@ -0,0 +1,239 @@
+"""End-to-end o'tkazuvchanlik benchmarki (lokal soxta Telegram API bilan)
+
+Ishga tushirish:
+    python -m bench.e2e --storage json --mode direct --updates 2000
+    python -m bench.e2e --storage both --mode loop --latency 0.01 --rate-limit 0.02
+    python -m bench.e2e --storage mongo --mongo-uri mongodb://localhost:27017
+    python -m bench.e2e --mode loop --runtime async --latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from bench.common import (ADMIN_ID, BENCH_TOKEN, FIRST_USER_ID, ROOT, import_bot, make_update,
+                          make_user, percentile, remove_workdir, write_result)
+from bench.fake_telegram import FakeTelegram
+
+# Trafik turlari: nom -> (yuboruvchi, matn)
+TRAFFIC = {
+    'text': lambda uid: (uid, f"Salom, savolim bor #{random.randint(1, 10 ** 6)}"),
+    'start': lambda uid: (uid, "/start"),
+    'help': lambda uid: (uid, "ℹ️ Yordam"),
+    'stats': lambda uid: (ADMIN_ID, "📊 Statistika"),
+}
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in TRAFFIC:
+            raise argparse.ArgumentTypeError(f"noma'lum trafik turi: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def build_updates(count, users, mix, first_update_id=1):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    updates = []
+    for i in range(count):
+        kind = random.choices(names, weights)[0]
+        uid = FIRST_USER_ID + random.randrange(users)
+        sender, text = TRAFFIC[kind](uid)
+        updates.append(make_update(first_update_id + i, sender, text))
+    return updates
+
+def run_direct(bot, fake, updates):
+    data = bot.load_data()
+    latencies = []
+    start = time.perf_counter()
+    for update in updates:
+        chat_id = update['message']['chat']['id']
+        before = fake.reply_count(chat_id)
+        t0 = time.perf_counter()
+        data = bot.process_message(update, data)
+        replies = fake.replies_for(chat_id)[before:]
+        if replies and chat_id != ADMIN_ID:
+            latencies.append(replies[0] - t0)
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies
+
+def loop_done(fake, by_chat, last_id):
+    # Bot barcha update'larni olgan (offset tasdiqlangan) va har bir chat o'z update'lari sonicha
+    # javob olgan bo'lishi kerak (flood control o'chiq - bittadan); async runtime offset ni
+    # update'lar tugashidan oldin tasdiqlaydi, shuning uchun javoblar alohida tekshiriladi
+    if fake.acked_offset <= last_id:
+        return False
+    return all(fake.reply_count(chat_id) >= len(update_ids) for chat_id, update_ids in by_chat.items())
+
+def run_loop(bot, fake, updates, timeout):
+    if not fake.wait_for_poll(timeout):
+        raise RuntimeError("bot getUpdates chaqirmadi")
+
+    # Har bir chat uchun k-chi update k-chi javobga mos keladi (adminlardan tashqari)
+    by_chat = {}
+    for update in updates:
+        chat_id = update['message']['chat']['id']
+        if chat_id != ADMIN_ID:
+            by_chat.setdefault(chat_id, []).append(update['update_id'])
+
+    start = time.perf_counter()
+    fake.push_updates(updates)
+    last_id = updates[-1]['update_id']
+    deadline = time.time() + timeout
+    while not loop_done(fake, by_chat, last_id):
+        if time.time() > deadline:
+            raise RuntimeError(f"{timeout}s ichida barcha update'lar qayta ishlanmadi")
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for chat_id, update_ids in by_chat.items():
+        for update_id, replied in zip(update_ids, fake.replies_for(chat_id)):
+            delivered = fake.delivered.get(update_id)
+            if delivered is not None and replied >= delivered:
+                latencies.append(replied - delivered)
+    return elapsed, latencies
+
+def run_broadcast(bot, users):
+    joined = bot.format_tashkent_time()
+    data = bot.load_data()
+    data['users'] = {str(FIRST_USER_ID + i): make_user(FIRST_USER_ID + i, joined, joined) for i in range(users)}
+    start = time.perf_counter()
+    bot.broadcast_message(ADMIN_ID, {'type': 'text', 'text': "📣 Benchmark"}, data)
+    return time.perf_counter() - start
+
+def run_single(args):
+    random.seed(args.seed)
+    os.environ['BOT_RUNTIME'] = args.runtime
+    workdir = tempfile.mkdtemp(prefix='codermrxbot-bench-')
+    fake = FakeTelegram(latency=args.latency, rate_limit=args.rate_limit, seed=args.seed).start()
+
+    mongo_db = None
+    if args.storage == 'mongo':
+        mongo_db = f"codermrxbot_bench_{os.getpid()}"
+    else:
+        # JSON rejimi: Mongo ga ulanish urinishini tez muvaffaqiyatsiz qilish
+        os.environ['MONGO_URI'] = 'mongodb://127.0.0.1:1'
+    bot = import_bot(workdir, fake.base_url(BENCH_TOKEN), args.mongo_uri if mongo_db else None, mongo_db)
+    bot.BROADCAST_DELAY = args.broadcast_delay
+
+    if mongo_db and args.mode == 'direct':
+        bot.init_mongodb()
+        if not bot.mongo_connected:
+            raise SystemExit(f"❌ MongoDB ga ulanmadi: {args.mongo_uri}")
+
+    updates = build_updates(args.updates, args.users, args.mix)
+    loop_thread = None
+    try:
+        if args.mode == 'direct':
+            elapsed, latencies = run_direct(bot, fake, updates)
+        else:
+            loop_thread = threading.Thread(target=bot.main, daemon=True)
+            loop_thread.start()
+            elapsed, latencies = run_loop(bot, fake, updates, args.timeout)
+        broadcast_time = run_broadcast(bot, args.broadcast_users) if args.broadcast_users else None
+    finally:
+        # Bot loop ini to'xtatib kutish - aks holda interpreter yopilayotganda handler'lar ishlab qoladi
+        if loop_thread is not None:
+            bot.request_stop()
+            loop_thread.join(30)
+        fake.stop()
+        if mongo_db:
+            try:
+                import pymongo
+                pymongo.MongoClient(args.mongo_uri, serverSelectionTimeoutMS=2000).drop_database(mongo_db)
+            except Exception:
+                pass
+        remove_workdir(workdir)
+
+    return {
+        'storage': 'mongo' if bot.mongo_connected else 'json',
+        'mode': args.mode,
+        'runtime': args.runtime if args.mode == 'loop' else 'direct',
+        'updates': len(updates),
+        'users': args.users,
+        'mix': args.mix,
+        'api_latency_s': args.latency,
+        'rate_limit_ratio': args.rate_limit,
+        'elapsed_s': round(elapsed, 4),
+        'updates_per_s': round(len(updates) / elapsed, 2) if elapsed else None,
+        'reply_latency_ms': {
+            'samples': len(latencies),
+            'p50': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            'p99': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        },
+        'broadcast': {
+            'users': args.broadcast_users,
+            'delay_s': args.broadcast_delay,
+            'completion_s': round(broadcast_time, 4) if broadcast_time is not None else None,
+        },
+        'api_calls': dict(fake.calls),
+        'api_429': dict(fake.throttled),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="codermrxbot end-to-end benchmark")
+    parser.add_argument('--storage', choices=['json', 'mongo', 'both'], default='json')
+    parser.add_argument('--mode', choices=['direct', 'loop'], default='direct',
+                        help="direct: process_message ni to'g'ridan-to'g'ri chaqirish, loop: main() ni ishga tushirish")
+    parser.add_argument('--runtime', choices=['sync', 'async'], default='sync',
+                        help="loop rejimida main() qaysi runtime bilan ishlashi (BOT_RUNTIME)")
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('text=70,start=15,help=10,stats=5'))
+    parser.add_argument('--latency', type=float, default=0.0, help="soxta API javob kechikishi (soniya)")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="429 qaytariladigan so'rovlar ulushi (0..1)")
+    parser.add_argument('--broadcast-users', type=int, default=500)
+    parser.add_argument('--broadcast-delay', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    if args.storage != 'both':
+        write_result(run_single(args), args.output)
+        return
+
+    # Har bir saqlash rejimi alohida jarayonda (main.py modul darajasida sozlanadi)
+    results = []
+    for storage in ('json', 'mongo'):
+        cmd = [sys.executable, '-m', 'bench.e2e', '--storage', storage] + _strip_args(sys.argv[1:], ('--storage', '--output'))
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode != 0:
+            results.append({'storage': storage, 'error': proc.stderr.strip().splitlines()[-1:] or proc.returncode})
+            continue
+        results.append(_last_json(proc.stdout))
+    write_result(results, args.output)
+
+def _strip_args(argv, names):
+    out = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg in names:
+            skip = True
+            continue
+        if any(arg.startswith(n + '=') for n in names):
+            continue
+        out.append(arg)
+    return out
+
+def _last_json(stdout):
+    # Bot o'z loglarini ham chiqaradi - natija oxirgi JSON blok
+    start = stdout.rfind('\n{')
+    return json.loads(stdout[start + 1:] if start != -1 else stdout[stdout.find('{'):])
+
+if __name__ == '__main__':
+    main()
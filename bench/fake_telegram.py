@@ -0,0 +1,153 @@
+import json
+import time
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+SEND_METHODS = {'sendMessage', 'sendPhoto', 'forwardMessage', 'copyMessage', 'sendDocument'}
+
+class FakeTelegram:
+    """Lokal Bot API o'rinbosari: getUpdates navbati, kechikish va 429 xatolar"""
+
+    def __init__(self, latency=0.0, rate_limit=0.0, retry_after=1, poll_wait=0.5, seed=None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.poll_wait = poll_wait
+        self.random = random.Random(seed)
+
+        self.cond = threading.Condition()
+        self.updates = []
+        self.acked_offset = 0
+        self.delivered = {}      # update_id -> getUpdates qaytargan vaqt
+        self.replies = {}        # chat_id -> [javob urinishlari vaqti, 429 ham hisoblanadi]
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.message_id = 0
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def base_url(self, token):
+        return f"http://127.0.0.1:{self.port}/bot{token}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_updates(self, updates):
+        with self.cond:
+            self.updates.extend(updates)
+            self.cond.notify_all()
+
+    def reply_count(self, chat_id):
+        with self.cond:
+            return len(self.replies.get(chat_id, []))
+
+    def replies_for(self, chat_id):
+        with self.cond:
+            return list(self.replies.get(chat_id, []))
+
+    def wait_for_poll(self, timeout=30):
+        """Bot birinchi marta getUpdates chaqirgunicha kutadi"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.calls['getUpdates']:
+                return True
+            time.sleep(0.05)
+        return False
+
+    # API
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        wait = min(float(params.get('timeout') or 0), self.poll_wait)
+        with self.cond:
+            if offset:
+                self.acked_offset = max(self.acked_offset, offset)
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates and wait > 0:
+                self.cond.wait(wait)
+            batch = self.updates[:limit]
+            now = time.perf_counter()
+            for update in batch:
+                self.delivered.setdefault(update['update_id'], now)
+        return {'ok': True, 'result': batch}
+
+    def _record_reply(self, params):
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return None
+        with self.cond:
+            self.replies.setdefault(chat_id, []).append(time.perf_counter())
+        return chat_id
+
+    def _send(self, chat_id):
+        with self.cond:
+            self.message_id += 1
+            message_id = self.message_id
+        return {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}}}
+
+    def handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.cond:
+            self.calls[method] += 1
+        chat_id = self._record_reply(params) if method in SEND_METHODS else None
+        if method in SEND_METHODS and self.rate_limit and self.random.random() < self.rate_limit:
+            with self.cond:
+                self.throttled[method] += 1
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': 'Too Many Requests: retry later',
+                         'parameters': {'retry_after': self.retry_after}}
+        if method == 'getUpdates':
+            return 200, self._get_updates(params)
+        if method in SEND_METHODS:
+            return 200, self._send(chat_id)
+        return 200, {'ok': True, 'result': True}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self):
+                url = urlsplit(self.path)
+                method = url.path.rstrip('/').rsplit('/', 1)[-1]
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if body and 'application/json' in (self.headers.get('Content-Type') or ''):
+                    try:
+                        params.update(json.loads(body))
+                    except ValueError:
+                        pass
+
+                status, payload = fake.handle(method, params)
+                raw = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,194 @@
+"""Foydalanuvchilar soniga bog'liq funksiyalar uchun micro-benchmark
+
+Har bir o'lcham uchun sintetik ma'lumot yaratiladi va get_stats, export_users_to_excel,
+save_data, load_data hamda broadcast_message ichidagi foydalanuvchilar sikli o'lchanadi
+(vaqt va eng yuqori xotira). Natijalar baseline bilan solishtiriladi.
+
+Ishga tushirish:
+    python -m bench.scale --sizes 1000,10000 --save-baseline
+    python -m bench.scale --sizes 1000,10000          # baseline bilan solishtirish
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import timedelta
+
+from bench.common import (ADMIN_ID, BENCH_TOKEN, FIRST_USER_ID, ROOT, import_bot, make_user, remove_workdir,
+                          write_result)
+from bench.fake_telegram import FakeTelegram
+
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+DEFAULT_BASELINE = os.path.join(ROOT, 'bench', 'scale_baseline.json')
+
+def build_data(bot, size):
+    now = bot.get_tashkent_time()
+    users = {}
+    for i in range(size):
+        uid = FIRST_USER_ID + i
+        joined = now - timedelta(days=random.randint(0, 365), seconds=random.randint(0, 86399))
+        active = now - timedelta(days=random.randint(0, 30), seconds=random.randint(0, 86399))
+        users[str(uid)] = make_user(uid, bot.format_tashkent_time(joined), bot.format_tashkent_time(active),
+                                    message_count=random.randint(1, 500))
+    messages = [{'user_id': FIRST_USER_ID + random.randrange(size), 'text': f"xabar {i}",
+                 'date': bot.format_tashkent_time(now)} for i in range(200)]
+    return {'users': users, 'channels': {}, 'admins': [ADMIN_ID], 'messages': messages}
+
+def measure(func, memory=True, repeats=5):
+    """Vaqt - bir necha urinishning eng kichigi (shovqinga chidamli), xotira - tracemalloc bilan alohida"""
+    timings = []
+    gc.collect()
+    # timeit kabi: GC pauzalari oldingi o'lchovlar qoldig'iga bog'liq - vaqt o'lchovidan chiqariladi
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    timings.sort()
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'wall_s': round(timings[0], 4), 'wall_median_s': round(timings[len(timings) // 2], 4),
+            'repeats': repeats, 'peak_bytes': peak}
+
+def broadcast_loop(bot, data):
+    """broadcast_message ni tarmoqsiz ishga tushiradi - faqat foydalanuvchilar sikli o'lchanadi"""
+    originals = bot.send_message, bot.send_photo, bot.forward_message
+    bot.send_message = bot.send_photo = bot.forward_message = lambda *args, **kwargs: True
+    try:
+        bot.broadcast_message(ADMIN_ID, {'type': 'text', 'text': "📣 Benchmark"}, data)
+    finally:
+        bot.send_message, bot.send_photo, bot.forward_message = originals
+
+def benchmarks(bot, data):
+    return {
+        # save_data Mongo ga faqat o'zgargan userlarni yozadi - hammasini o'zgargan deb belgilaymiz
+        'save_data': lambda: (bot.mark_users_dirty(data['users']), bot.save_data(data)),
+        'load_data': bot.load_data,
+        'get_stats': lambda: bot.get_stats(data),
+        'export_users_to_excel': lambda: bot.export_users_to_excel(ADMIN_ID, data),
+        'broadcast_loop': lambda: broadcast_loop(bot, data),
+    }
+
+def run_size(bot, size, memory, repeats, baseline=None, args=None):
+    random.seed(size)
+    data = build_data(bot, size)
+    results = {}
+    for name, func in benchmarks(bot, data).items():
+        results[name] = measure(func, memory, repeats)
+        base = (baseline or {}).get(str(size), {}).get(name)
+        # Sekinlashuv ko'rinsa - tasodifiy yuklama emasligini qayta o'lchab tasdiqlash
+        for _ in range(args.confirm if base else 0):
+            if not is_slower(results[name], base, args.time_tolerance, args.min_seconds):
+                break
+            time.sleep(1)
+            retry = measure(func, False, repeats)
+            results[name]['wall_s'] = min(results[name]['wall_s'], retry['wall_s'])
+            results[name]['repeats'] += repeats
+    return results
+
+def is_slower(current, base, time_tolerance, min_seconds):
+    # Joriy eng yaxshi vaqt baseline ning odatiy (median) vaqti bilan solishtiriladi
+    expected = base.get('wall_median_s', base['wall_s'])
+    return current['wall_s'] - expected > min_seconds and current['wall_s'] > expected * (1 + time_tolerance)
+
+def compare(results, baseline, time_tolerance, memory_tolerance, min_seconds):
+    """Baseline dan sezilarli sekinlashgan yoki ko'p xotira olgan o'lchovlar ro'yxati"""
+    regressions = []
+    for size, funcs in results.items():
+        for name, current in funcs.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            if is_slower(current, base, time_tolerance, min_seconds):
+                regressions.append(f"{name} @ {size}: {base.get('wall_median_s', base['wall_s'])}s -> {current['wall_s']}s")
+            if current.get('peak_bytes') and base.get('peak_bytes') and \
+                    current['peak_bytes'] > base['peak_bytes'] * (1 + memory_tolerance):
+                regressions.append(f"{name} @ {size}: peak {base['peak_bytes']} -> {current['peak_bytes']} bytes")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="codermrxbot scale micro-benchmark")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="vergul bilan ajratilgan foydalanuvchilar soni")
+    parser.add_argument('--storage', choices=['json', 'mongo'], default='json')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--no-memory', action='store_true', help="tracemalloc bilan xotirani o'lchamaslik")
+    parser.add_argument('--repeats', type=int, default=3, help="har bir o'lchov necha marta takrorlanadi (eng kichigi olinadi)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--time-tolerance', type=float, default=0.25)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help="bundan kichik sekinlashuvlar shovqin deb hisoblanadi")
+    parser.add_argument('--confirm', type=int, default=2,
+                        help="sekinlashuv ko'ringanda necha marta qayta o'lchab tasdiqlanadi")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    workdir = tempfile.mkdtemp(prefix='codermrxbot-scale-')
+    fake = FakeTelegram().start()
+
+    mongo_db = f"codermrxbot_scale_{os.getpid()}" if args.storage == 'mongo' else None
+    if not mongo_db:
+        os.environ['MONGO_URI'] = 'mongodb://127.0.0.1:1'
+    baseline_path = os.path.abspath(args.baseline)
+    output = os.path.abspath(args.output) if args.output else None
+    bot = import_bot(workdir, fake.base_url(BENCH_TOKEN), args.mongo_uri if mongo_db else None, mongo_db)
+    bot.BROADCAST_DELAY = 0
+    if mongo_db:
+        bot.init_mongodb()
+        if not bot.mongo_connected:
+            raise SystemExit(f"❌ MongoDB ga ulanmadi: {args.mongo_uri}")
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get(args.storage, {})
+
+    results = {}
+    try:
+        for size in sizes:
+            print(f"⏱️ {size} foydalanuvchi...", file=sys.stderr)
+            results[str(size)] = run_size(bot, size, not args.no_memory, max(1, args.repeats), baseline, args)
+    finally:
+        fake.stop()
+        if mongo_db:
+            bot.users_col.database.client.drop_database(mongo_db)
+        remove_workdir(workdir)
+
+    report = {'storage': args.storage, 'results': results}
+    exit_code = 0
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.setdefault(args.storage, {}).update(results)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        report['baseline_saved'] = baseline_path
+    elif baseline is not None:
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance, args.min_seconds)
+        report['regressions'] = regressions
+        exit_code = 1 if regressions else 0
+
+    write_result(report, output)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def _matches(doc, query):
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == '$in' and value not in arg:
+                    return False
+                if op == '$ne' and value == arg:
+                    return False
+                if op == '$gte' and (value is None or value < arg):
+                    return False
+                if op == '$size' and len(value or []) != arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+def _project(doc, projection):
+    doc = dict(doc)
+    for field, keep in (projection or {}).items():
+        if not keep:
+            doc.pop(field, None)
+    return doc
+
+class FakeCursor(list):
+    def sort(self, field, direction=1):
+        return FakeCursor(sorted(self, key=lambda d: d.get(field), reverse=direction < 0))
+
+    def batch_size(self, size):
+        return self
+
+class FakeCollection:
+    """Testlar uchun xotiradagi Mongo kolleksiyasi (bot va migrate ishlatadigan amallar)"""
+
+    def __init__(self, db, name):
+        self.database = db
+        self.name = name
+        self.docs = []
+        self.fail = None   # o'rnatilsa yozish shu xatoni ko'taradi
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(_project(d, projection) for d in self.docs if _matches(d, query or {}))
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.insert_one(doc)
+
+    def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            raise self.fail
+        for op in ops:
+            target = next((d for d in self.docs if _matches(d, op._filter)), None)
+            if target is None:
+                if not op._upsert:
+                    continue
+                target = dict(op._filter)
+                self.docs.append(target)
+                target.update(op._doc.get('$setOnInsert', {}))
+            target.update(op._doc.get('$set', {}))
+            for field, value in op._doc.get('$max', {}).items():
+                if target.get(field) is None or value > target[field]:
+                    target[field] = value
+            for field, value in op._doc.get('$min', {}).items():
+                if target.get(field) is None or value < target[field]:
+                    target[field] = value
+
+    def aggregate(self, pipeline, **kwargs):
+        docs = [dict(d) for d in self.docs]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == '$match':
+                docs = [d for d in docs if _matches(d, arg)]
+            elif op == '$lookup':
+                other = self.database[arg['from']].docs
+                for d in docs:
+                    d[arg['as']] = [o for o in other if o.get(arg['foreignField']) == d.get(arg['localField'])]
+            elif op == '$project':
+                docs = [_project(d, arg) for d in docs]
+        return iter(docs)
+
+    def drop(self):
+        self.database.collections.pop(self.name, None)
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+        self.created = []   # drop qilinganlar ham - testlar nima yaratilganini tekshiradi
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+            self.created.append(name)
+        return self.collections[name]
+
+@pytest.fixture
+def fake_db():
+    return FakeDatabase()
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """main.py moduli - har test o'z data/ katalogida va toza global holat bilan"""
+    monkeypatch.setenv('BOT_TOKEN', '123456:TEST')
+    monkeypatch.setenv('MAIN_ADMIN', '1')
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data', exist_ok=True)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = sys.modules.get('main') or importlib.import_module('main')
+
+    monkeypatch.setattr(module, 'mongo_connected', False)
+    monkeypatch.setattr(module, 'users_col', None)
+    monkeypatch.setattr(module, 'channels_col', None)
+    monkeypatch.setattr(module, 'mongo_resync', False)
+    monkeypatch.setattr(module, 'mongo_replay', False)
+    monkeypatch.setattr(module, 'pending_mongo_channels', False)
+    monkeypatch.setattr(module, 'pending_mongo_users', set())
+    monkeypatch.setattr(module, 'mongo_breaker', module.CircuitBreaker('MongoDB'))
+    monkeypatch.setattr(module, 'telegram_breaker', module.CircuitBreaker('Telegram API'))
+    monkeypatch.setattr(module, 'mongo_stats', dict(module.mongo_stats, disconnects=0, reconnects=0, replayed=0, overflows=0))
+    return module
@@ -7,8 +7,23 @@ from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 import pymongo
 import threading
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from collections import deque
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
 import logging
+import sys
+import re
+import bisect
+import pickle
+import signal
+import zlib
+import tracemalloc
+import html
+import hmac
 
 # Log sozlamalari - faqat muhim loglar
 logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -28,10 +43,53 @@ except Exception:
 
 BASE_URL = f"https://api.telegram.org/bot{TOKEN}/"
 
+# Debug endpoint tokeni (o'rnatilmagan bo'lsa /debug/* o'chirilgan)
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+# tracemalloc sessiyasi shuncha soniyadan keyin avtomatik to'xtatiladi
+DEBUG_TRACE_TTL = int(os.getenv('DEBUG_TRACE_TTL', '600'))
+
 # Mongo settings
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
 MONGO_DB = os.getenv('MONGO_DB', 'codermrxbot')
 
+# Mongo ulanish puli, write concern, qayta ulanish oralig'i (soniya) va uzilish paytidagi bufer hajmi
+MONGO_MAX_POOL = int(os.getenv('MONGO_MAX_POOL', '20'))
+MONGO_MIN_POOL = int(os.getenv('MONGO_MIN_POOL', '1'))
+MONGO_MAX_IDLE_MS = int(os.getenv('MONGO_MAX_IDLE_MS', '300000'))
+MONGO_WAIT_QUEUE_MS = int(os.getenv('MONGO_WAIT_QUEUE_MS', '5000'))
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', '5000'))
+# Bitta so'rov javobini kutish chegarasi - osilib qolgan ulanish handler/qulfni cheksiz ushlab turmasin
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+# bulk_write va qayta ulanishdagi $in so'rovlari hajmi
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', '1000'))
+MONGO_WRITE_CONCERN = os.getenv('MONGO_WRITE_CONCERN', '1')
+MONGO_RECONNECT_MIN = float(os.getenv('MONGO_RECONNECT_MIN', '5'))
+MONGO_RECONNECT_MAX = float(os.getenv('MONGO_RECONNECT_MAX', '300'))
+MONGO_BUFFER_MAX = int(os.getenv('MONGO_BUFFER_MAX', '50000'))
+
+# Broadcast paytida xabarlar orasidagi pauza (Telegram rate limit)
+BROADCAST_DELAY = float(os.getenv('BROADCAST_DELAY', '0.1'))
+
+# Flood control: soniyasiga to'ladigan tokenlar, maksimal burst va jamlash oynasi (soniya)
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', '0.5'))
+FLOOD_BURST = int(os.getenv('FLOOD_BURST', '5'))
+FLOOD_WINDOW = float(os.getenv('FLOOD_WINDOW', '10'))
+# Jamlangan to'plamda saqlanadigan rasm/fayllar soni (albom 10 tagacha bo'ladi)
+FLOOD_MEDIA_MAX = int(os.getenv('FLOOD_MEDIA_MAX', '10'))
+
+# Runtime: 'sync' (requests bilan ketma-ket) yoki 'async' (aiohttp, chatlar parallel)
+BOT_RUNTIME = os.getenv('BOT_RUNTIME', 'sync').lower()
+ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', '8'))
+# Xotirada navbatda turgan update'lar chegarasi - oshsa yangi getUpdates biror update tugaguncha kutadi
+ASYNC_MAX_INFLIGHT = int(os.getenv('ASYNC_MAX_INFLIGHT', '1000'))
+
+# Circuit breaker: oyna (soniya), minimal chaqiruvlar, xato ulushi va backoff chegaralari
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', '60'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_FAILURE_RATIO = float(os.getenv('BREAKER_FAILURE_RATIO', '0.5'))
+BREAKER_BASE_DELAY = float(os.getenv('BREAKER_BASE_DELAY', '2'))
+BREAKER_MAX_DELAY = float(os.getenv('BREAKER_MAX_DELAY', '120'))
+
 # Toshkent vaqti (UTC+5)
 TASHKENT_TZ = timezone(timedelta(hours=5))
 
@@ -66,24 +124,224 @@ def format_uptime(seconds):
 # Bot ishga tushgan vaqti
 BOT_START_TIME = get_tashkent_time()
 
+# Circuit breaker - xizmat ishlamayotganda chaqiruvlar kutmasdan rad etiladi
+class CircuitBreaker:
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_ratio=BREAKER_FAILURE_RATIO, base_delay=BREAKER_BASE_DELAY, max_delay=BREAKER_MAX_DELAY):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.calls = deque()   # (vaqt, muvaffaqiyatli)
+        self.failures = 0
+        self.state = 'closed'
+        self.open_until = 0
+        self.open_count = 0     # ketma-ket ochilishlar - backoff uchun
+        self.probing = False
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() >= self.open_until:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                # Bitta sinov chaqiruvi o'tkaziladi
+                self.probing = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            now = time.time()
+            if self.state == 'half_open':
+                self.probing = False
+                if ok:
+                    self.state = 'closed'
+                    self.open_count = 0
+                    print(f"✅ {self.name} qayta ishlayapti")
+                else:
+                    self._open(now)
+                return
+            if self.state == 'open':
+                return
+
+            self.calls.append((now, ok))
+            if not ok:
+                self.failures += 1
+            while self.calls and now - self.calls[0][0] > self.window:
+                if not self.calls.popleft()[1]:
+                    self.failures -= 1
+            if len(self.calls) >= self.min_calls and self.failures / len(self.calls) >= self.failure_ratio:
+                self._open(now)
+
+    def _open(self, now):
+        # Eksponensial backoff + jitter
+        delay = min(self.max_delay, self.base_delay * (2 ** self.open_count))
+        delay = random.uniform(delay / 2, delay)
+        self.open_count += 1
+        self.state = 'open'
+        self.open_until = now + delay
+        self.calls.clear()
+        self.failures = 0
+        self.stats['opened'] += 1
+        print(f"⚠️ {self.name} ishlamayapti, {delay:.1f}s pauza")
+
+    def is_open(self):
+        with self.lock:
+            return self.state == 'open' and time.time() < self.open_until
+
+    def is_closed(self):
+        with self.lock:
+            return self.state == 'closed'
+
+    def remaining(self):
+        with self.lock:
+            return max(0.0, self.open_until - time.time()) if self.state == 'open' else 0.0
+
+    def wait(self, max_wait=None):
+        """Breaker yopilguncha (yoki sinov vaqti kelguncha) kutadi, kutilgan vaqtni qaytaradi"""
+        delay = self.remaining()
+        if max_wait is not None:
+            delay = min(delay, max_wait)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def wait_ready(self):
+        """Chaqiruv o'tishi mumkin bo'lguncha kutadi (ochiq - sinov vaqtigacha, sinov ketmoqda - natijasigacha)"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                if self.state == 'closed' or (self.state == 'half_open' and not self.probing):
+                    return waited
+                delay = self.open_until - time.time() if self.state == 'open' else 0.1
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+telegram_breaker = CircuitBreaker('Telegram API')
+mongo_breaker = CircuitBreaker('MongoDB')
+
+# Umumiy holat qulfi - async runtime da handlerlar parallel ishlaydi
+state_lock = threading.RLock()
+
 # Global o'zgaruvchilar
 mongo_connected = False
+mongo_client = None
 users_col = channels_col = None
+mongo_reconnecting = False
+mongo_stats = {'disconnects': 0, 'reconnects': 0, 'replayed': 0, 'overflows': 0,
+               'last_reconnect': None, 'last_error': None}
+
+def mongo_client_options():
+    w = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+    return {
+        'maxPoolSize': MONGO_MAX_POOL,
+        'minPoolSize': MONGO_MIN_POOL,
+        'maxIdleTimeMS': MONGO_MAX_IDLE_MS,
+        'waitQueueTimeoutMS': MONGO_WAIT_QUEUE_MS,
+        'serverSelectionTimeoutMS': MONGO_TIMEOUT_MS,
+        'connectTimeoutMS': MONGO_TIMEOUT_MS,
+        'socketTimeoutMS': MONGO_SOCKET_TIMEOUT_MS,
+        'retryWrites': True,
+        'retryReads': True,
+        'w': w,
+    }
+
+def connect_mongo_collections():
+    """Ping o'tsa kolleksiyalar va indekslarni tayyorlaydi, aks holda xato ko'taradi
+    (mongo_connected ni chaqiruvchi yoqadi - qayta ulanishda avval holat birlashtiriladi)"""
+    global users_col, channels_col
+    mongo_client.admin.command('ping')
+    db = mongo_client[MONGO_DB]
+    users_col = db['users']
+    channels_col = db['channels']
+    try:
+        # Segment so'rovlari va upsert uchun indekslar
+        users_col.create_index('id')
+        users_col.create_index('last_active')
+        users_col.create_index('joined')
+    except Exception:
+        pass
 
 # MongoDB ulanish
 def init_mongodb():
-    global mongo_connected, users_col, channels_col
+    global mongo_connected, mongo_client, mongo_resync
+    try:
+        mongo_client = pymongo.MongoClient(MONGO_URI, **mongo_client_options())
+    except Exception as e:
+        # Noto'g'ri URI yoki sozlama - qayta urinishdan foyda yo'q
+        mongo_connected = False
+        print(f"❌ MongoDB sozlamasi xato: {e}")
+        return
     try:
-        mongo_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        mongo_client.admin.command('ping')
+        connect_mongo_collections()
         mongo_connected = True
-        db = mongo_client[MONGO_DB]
-        users_col = db['users']
-        channels_col = db['channels']
         print("✅ MongoDB ga ulandi")
-    except Exception:
+    except Exception as e:
         mongo_connected = False
-        print("❌ MongoDB ga ulanmadi")
+        mongo_stats['last_error'] = str(e)
+        # Mongo dagi holat noma'lum - qayta ulanganda xotiradagi holat bilan birlashtiriladi
+        mongo_resync = True
+        print("❌ MongoDB ga ulanmadi, fonda qayta urinib ko'riladi")
+        start_mongo_reconnect()
+
+def mongo_disconnected(error):
+    """Ulanish uzildi: JSON rejimiga o'tish va fonda qayta ulanish"""
+    global mongo_connected
+    if mongo_connected:
+        mongo_connected = False
+        mongo_stats['disconnects'] += 1
+        print(f"⚠️ MongoDB bilan aloqa uzildi: {error}")
+    mongo_stats['last_error'] = str(error)
+    start_mongo_reconnect()
+
+def start_mongo_reconnect():
+    global mongo_reconnecting
+    with state_lock:
+        if mongo_reconnecting or mongo_client is None:
+            return
+        mongo_reconnecting = True
+    threading.Thread(target=mongo_reconnect_loop, daemon=True).start()
+
+def mongo_reconnect_loop():
+    """Mongo ga qayta ulanguncha eksponensial backoff + jitter bilan urinadi"""
+    global mongo_connected, mongo_reconnecting, mongo_replay, mongo_resync
+    attempt = 0
+    while True:
+        delay = min(MONGO_RECONNECT_MAX, MONGO_RECONNECT_MIN * (2 ** attempt))
+        time.sleep(random.uniform(delay / 2, delay))
+        attempt += 1
+        # Ping va Mongo so'rovlari qulfsiz - handlerlar timeout kutib qolmasin
+        try:
+            connect_mongo_collections()
+            # Xotiradagi holat eski users.json dan bo'lishi mumkin - Mongo ni bosib ketmasdan birlashtiramiz
+            # (ma'lumot hali yuklanmagan bo'lsa - load_data uni Mongo dan o'qiydi)
+            if bot_data is not None:
+                reconcile_mongo(bot_data)
+            break
+        except Exception as e:
+            mongo_stats['last_error'] = str(e)
+
+    with state_lock:
+        if bot_data is None:
+            mongo_resync = False
+        mongo_connected = True
+        mongo_reconnecting = False
+        mongo_replay = True
+        mongo_stats['reconnects'] += 1
+        mongo_stats['last_reconnect'] = format_tashkent_time()
+        print(f"✅ MongoDB ga qayta ulandi ({attempt}-urinish)")
+    # Uzilish paytidagi yozuvlarni darhol qayta yozish
+    if bot_data is not None:
+        flush_mongo(bot_data)
 
 # Fayl tizimi
 os.makedirs('data', exist_ok=True)
@@ -94,6 +352,17 @@ CHANNELS_FILE = 'data/channels.json'
 ADMINS_FILE = 'data/admins.json'
 MESSAGES_FILE = 'data/messages.json'
 LAST_OFFSET_FILE = 'data/last_offset.txt'
+INFLIGHT_FILE = 'data/inflight.json'  # async runtime: Telegramga tasdiqlangan, lekin tugallanmagan update'lar
+SNAPSHOT_FILE = 'data/state.snapshot'
+BOT_PID_FILE = 'data/bot.pid'  # migrate.py ishlab turgan botni shundan aniqlaydi
+
+# Holat snapshoti: format versiyasi va yozish oralig'i (soniya)
+SNAPSHOT_MAGIC = b'CMXSNAP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '300'))
+
+# Ishga tushishda xotiraga olinadigan oxirgi xabarlar soni (load_data va snapshot uchun bir xil)
+MESSAGES_LOAD_LIMIT = 100
 
 DEFAULT_DATA = {
     'users': {},
@@ -111,105 +380,448 @@ def safe_load_json(filename, default):
 
 def save_json(data, filename):
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
+        # Yarim yozilgan fayl qolmasligi uchun avval vaqtinchalik faylga
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, filename)
     except Exception:
         pass
 
+def user_from_doc(doc):
+    uid = str(doc.get('id') or doc.get('_id'))
+    return uid, {
+        'id': int(uid),
+        'first_name': doc.get('first_name', ''),
+        'last_name': doc.get('last_name', ''),
+        'username': doc.get('username', ''),
+        'phone': doc.get('phone', ''),
+        'joined': doc.get('joined', format_tashkent_time()),
+        'last_active': doc.get('last_active', format_tashkent_time()),
+        'message_count': int(doc.get('message_count', 0)),
+        'is_admin': bool(doc.get('is_admin', False))
+    }
+
+def load_mongo_users():
+    users = {}
+    for doc in users_col.find():
+        uid, user = user_from_doc(doc)
+        users[uid] = user
+    return users
+
+def load_mongo_channels():
+    channels = {}
+    for doc in channels_col.find():
+        key = doc.get('username') or str(doc.get('_id'))
+        channels[key] = {
+            'username': doc.get('username', key),
+            'name': doc.get('name', key),
+            'added_by': doc.get('added_by'),
+            'added_date': doc.get('added_date')
+        }
+    return channels
+
+def load_channels():
+    channels = {}
+    try:
+        if mongo_connected and channels_col is not None:
+            channels = load_mongo_channels()
+        else:
+            channels = safe_load_json(CHANNELS_FILE, DEFAULT_DATA['channels'])
+    except Exception:
+        channels = safe_load_json(CHANNELS_FILE, DEFAULT_DATA['channels'])
+    return channels
+
 def load_data():
     data = {'users': {}, 'channels': {}, 'admins': [], 'messages': []}
     
     # Users
     try:
         if mongo_connected and users_col is not None:
-            for doc in users_col.find():
-                uid = str(doc.get('id') or doc.get('_id'))
-                data['users'][uid] = {
-                    'id': int(uid),
-                    'first_name': doc.get('first_name', ''),
-                    'last_name': doc.get('last_name', ''),
-                    'username': doc.get('username', ''),
-                    'phone': doc.get('phone', ''),
-                    'joined': doc.get('joined', format_tashkent_time()),
-                    'last_active': doc.get('last_active', format_tashkent_time()),
-                    'message_count': int(doc.get('message_count', 0)),
-                    'is_admin': bool(doc.get('is_admin', False))
-                }
+            data['users'] = load_mongo_users()
         else:
             data['users'] = safe_load_json(USERS_FILE, DEFAULT_DATA['users'])
     except Exception:
         data['users'] = safe_load_json(USERS_FILE, DEFAULT_DATA['users'])
 
     # Channels
-    try:
-        if mongo_connected and channels_col is not None:
-            for doc in channels_col.find():
-                key = doc.get('username') or str(doc.get('_id'))
-                data['channels'][key] = {
-                    'username': doc.get('username', key),
-                    'name': doc.get('name', key),
-                    'added_by': doc.get('added_by'),
-                    'added_date': doc.get('added_date')
-                }
-        else:
-            data['channels'] = safe_load_json(CHANNELS_FILE, DEFAULT_DATA['channels'])
-    except Exception:
-        data['channels'] = safe_load_json(CHANNELS_FILE, DEFAULT_DATA['channels'])
+    data['channels'] = load_channels()
 
     # Admins
     data['admins'] = safe_load_json(ADMINS_FILE, DEFAULT_DATA['admins'])
     
     # Messages
-    data['messages'] = safe_load_json(MESSAGES_FILE, [])[-100:]
+    data['messages'] = safe_load_json(MESSAGES_FILE, [])[-MESSAGES_LOAD_LIMIT:]
 
     if MAIN_ADMIN and MAIN_ADMIN not in data['admins']:
         data['admins'].append(MAIN_ADMIN)
 
     return data
 
+# Mongo ga hali yozilmagan o'zgarishlar (breaker ochiq yoki aloqa uzilgan bo'lsa shu yerda to'planadi)
+pending_mongo_users = set()
+pending_mongo_channels = False
+# Bufer to'lib ketgan bo'lsa - keyingi yozishda barcha foydalanuvchilar qayta yoziladi
+mongo_resync = False
+# Qayta ulangandan keyingi birinchi yozish - statistikaga "replayed" deb olinadi
+mongo_replay = False
+
+def mark_users_dirty(user_ids):
+    global mongo_resync
+    pending_mongo_users.update(str(uid) for uid in user_ids)
+    if len(pending_mongo_users) > MONGO_BUFFER_MAX:
+        if not mongo_resync:
+            mongo_stats['overflows'] += 1
+            print(f"⚠️ Mongo buferi to'ldi ({MONGO_BUFFER_MAX}), ulanganda to'liq qayta yoziladi")
+        pending_mongo_users.clear()
+        mongo_resync = True
+
+def mark_channels_dirty():
+    global pending_mongo_channels
+    pending_mongo_channels = True
+
+def user_to_doc(uid, u):
+    return {
+        'id': int(uid),
+        'first_name': u.get('first_name', ''),
+        'last_name': u.get('last_name', ''),
+        'username': u.get('username', ''),
+        'phone': u.get('phone', ''),
+        'joined': u.get('joined', ''),
+        'last_active': u.get('last_active', ''),
+        'message_count': int(u.get('message_count', 0)),
+        'is_admin': bool(u.get('is_admin', False))
+    }
+
+def user_update(uid, u):
+    """Mongo dagi yangiroq qiymatlarni bosib ketmaydigan yangilash: faollik va hisoblagich
+    faqat oshadi, qo'shilgan sana faqat kamayadi"""
+    doc = user_to_doc(uid, u)
+    update = {
+        '$set': {field: doc[field] for field in ('first_name', 'last_name', 'username', 'phone', 'is_admin')},
+        '$max': {'last_active': doc['last_active'], 'message_count': doc['message_count']},
+    }
+    if doc['joined']:
+        update['$min'] = {'joined': doc['joined']}
+    return update
+
+def merge_user(user, remote):
+    """Mongo dagi yozuvni xotiradagi user ga qo'shadi (migrate.resolve_user qoidalari): profil - oxirgi
+    faol yozuvdan, last_active va message_count - kattasi, joined - eng birinchisi. user joyida
+    o'zgaradi (handler holat kalitlari saqlanadi); Mongo ga yozish kerak bo'lsa True"""
+    rank = lambda u: (u.get('last_active') or '', u.get('message_count', 0))
+    local = dict(user)
+    if rank(remote) > rank(local):
+        user.update(remote)
+    user['last_active'] = max(local.get('last_active') or '', remote.get('last_active') or '')
+    user['message_count'] = max(int(local.get('message_count', 0)), int(remote.get('message_count', 0)))
+    joined = [u['joined'] for u in (local, remote) if u.get('joined')]
+    if joined:
+        user['joined'] = min(joined)
+    return user_to_doc(remote['id'], user) != user_to_doc(remote['id'], remote)
+
+def reconcile_mongo(data):
+    """Qayta ulangach Mongo holatini xotiradagi bilan birlashtiradi; farq qilganlar yozishga belgilanadi.
+    Mongo MONGO_BATCH_SIZE lik bo'laklarda o'qiladi (migrate.merge_json_batch kabi $in bilan) - butun
+    kolleksiya xotiraga olinmaydi; so'rovlar qulfsiz, birlashtirish har bo'lak uchun qulf ostida"""
+    global mongo_resync
+    with state_lock:
+        local_ids = list(data['users'])
+    changed = 0
+    for start in range(0, len(local_ids), MONGO_BATCH_SIZE):
+        batch = local_ids[start:start + MONGO_BATCH_SIZE]
+        ids = [int(uid) for uid in batch if uid.lstrip('-').isdigit()]
+        remote = dict(user_from_doc(doc) for doc in users_col.find({'id': {'$in': ids}}))
+        with state_lock:
+            # Mongo da yo'q yoki xotiradagisi farq qiladigan userlar yoziladi
+            dirty = []
+            for uid in batch:
+                user = data['users'].get(uid)
+                if user is None:
+                    continue
+                if uid not in remote or merge_user(user, remote[uid]):
+                    dirty.append(uid)
+                user_index.update(uid, user)
+            mark_users_dirty(dirty)
+            changed += len(dirty)
+
+    # Faqat Mongo da bo'lgan userlar ham statistika, segment va qidiruvda ko'rinsin:
+    # faqat id lar oqim bilan o'qiladi, xotirada yo'qlari $in bilan to'liq olinadi
+    added = 0
+    def add_missing(ids):
+        nonlocal added
+        with state_lock:
+            missing = [uid for uid in ids if str(uid) not in data['users']]
+        if not missing:
+            return
+        users = [user_from_doc(doc) for doc in users_col.find({'id': {'$in': missing}})]
+        with state_lock:
+            for uid, user in users:
+                if uid not in data['users']:
+                    data['users'][uid] = user
+                    added += 1
+
+    batch = []
+    for doc in users_col.find({'id': {'$ne': None}}, {'id': 1, '_id': 0}).batch_size(MONGO_BATCH_SIZE):
+        batch.append(doc['id'])
+        if len(batch) >= MONGO_BATCH_SIZE:
+            add_missing(batch)
+            batch = []
+    add_missing(batch)
+
+    remote_channels = load_mongo_channels()
+    with state_lock:
+        if added:
+            # Ko'p bo'lishi mumkin (bo'sh users.json) - bittalab insort o'rniga qayta qurish
+            user_index.rebuild(data['users'])
+        # Mongo holati endi ma'lum - to'liq qayta yozish o'rniga faqat farqlar
+        mongo_resync = False
+        for key, channel in remote_channels.items():
+            data['channels'].setdefault(key, channel)
+        if any(key not in remote_channels for key in data['channels']):
+            mark_channels_dirty()
+    print(f"🔄 Mongo bilan birlashtirildi: {len(local_ids)} ta user tekshirildi, {added} tasi Mongo dan qo'shildi, "
+          f"{changed} tasi yoziladi")
+
+# Bir vaqtda faqat bitta flush_mongo yozadi (handler threadlar bir xil buferni ikki marta yubormasin)
+mongo_flush_lock = threading.Lock()
+
+def flush_mongo(data):
+    """O'zgargan foydalanuvchi/kanallarni MONGO_BATCH_SIZE lik bulk_write lar bilan yozadi. Yozuvlar
+    state_lock ostida tayyorlanadi, tarmoq so'rovi qulfsiz - sekin Mongo handlerlarni to'xtatmaydi"""
+    global pending_mongo_channels, mongo_resync, mongo_replay
+    if not (mongo_connected and users_col is not None):
+        return False
+    if not pending_mongo_users and not pending_mongo_channels and not mongo_resync:
+        return True
+    if not mongo_flush_lock.acquire(blocking=False):
+        return False   # boshqa thread yozmoqda - o'zgarishlar buferda qoladi
+    try:
+        if not mongo_breaker.allow():
+            return False
+
+        with state_lock:
+            resync = mongo_resync
+            user_ids = list(data['users']) if resync else list(pending_mongo_users)
+            channels_dirty = pending_mongo_channels or resync
+            # Buferdan hozir olinadi - yozish paytida yana o'zgarganlar qayta belgilanadi va yo'qolmaydi
+            if resync:
+                pending_mongo_users.clear()
+            else:
+                pending_mongo_users.difference_update(user_ids)
+            mongo_resync = False
+            pending_mongo_channels = False
+            channel_ops = [pymongo.UpdateOne({'username': c.get('username', key)}, {'$set': {
+                'username': c.get('username', key),
+                'name': c.get('name', key),
+                'added_by': c.get('added_by'),
+                'added_date': c.get('added_date')
+            }}, upsert=True) for key, c in data['channels'].items()] if channels_dirty and channels_col is not None else []
+
+        written = 0
+        try:
+            for written in range(0, len(user_ids), MONGO_BATCH_SIZE):
+                with state_lock:
+                    ops = [pymongo.UpdateOne({'id': int(uid)}, user_update(uid, data['users'][uid]), upsert=True)
+                           for uid in user_ids[written:written + MONGO_BATCH_SIZE] if uid in data['users']]
+                if ops:
+                    users_col.bulk_write(ops, ordered=False)
+            written = len(user_ids)
+            if channel_ops:
+                channels_col.bulk_write(channel_ops, ordered=False)
+            mongo_breaker.record(True)
+        except Exception as e:
+            mongo_breaker.record(False)
+            with state_lock:
+                # Yozilmay qolganlar buferga qaytadi
+                if resync:
+                    mongo_resync = True
+                else:
+                    mark_users_dirty(user_ids[written:])
+                if channels_dirty:
+                    pending_mongo_channels = True
+            if isinstance(e, pymongo.errors.ConnectionFailure):
+                mongo_disconnected(e)
+            else:
+                print(f"MongoDB ga yozishda xato: {e}")
+            return False
+
+        if mongo_replay:
+            mongo_replay = False
+            mongo_stats['replayed'] += len(user_ids)
+            print(f"✅ MongoDB ga {len(user_ids)} ta buferdagi yozuv qayta yozildi")
+        return True
+    finally:
+        mongo_flush_lock.release()
+
 def save_data(data):
-    # Users
+    # Mongo (faqat o'zgarganlar; ishlamasa keyingi saqlashgacha buferda qoladi) - qulfni o'zi oladi
+    flush_mongo(data)
+
+    with state_lock:
+        # Users
+        save_json(data['users'], USERS_FILE)
+
+        # Channels
+        save_json(data['channels'], CHANNELS_FILE)
+
+        # Admins
+        save_json(data['admins'], ADMINS_FILE)
+        
+        # Messages
+        save_json(data.get('messages', [])[-200:], MESSAGES_FILE)
+
+# Binar holat snapshoti - qayta ishga tushishda to'liq yuklashsiz tiklash
+def snapshot_sync_point(data):
+    """Snapshotdagi eng so'nggi last_active - Mongo dan shundan keyingi o'zgarishlar olinadi"""
+    return max((u.get('last_active') or '' for u in data['users'].values()), default='')
+
+def write_snapshot(data):
+    try:
+        with state_lock:
+            payload = {
+                'version': SNAPSHOT_VERSION,
+                'created': format_tashkent_time(),
+                'storage': 'mongo' if mongo_connected else 'json',
+                'sync_point': snapshot_sync_point(data),
+                'pending_mongo_users': list(pending_mongo_users),
+                'mongo_resync': mongo_resync,
+                'data': {
+                    'users': data['users'],
+                    'channels': data['channels'],
+                    'admins': data['admins'],
+                    'messages': data.get('messages', [])[-MESSAGES_LOAD_LIMIT:]
+                }
+            }
+            raw = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        body = zlib.compress(raw, 1)
+        tmp_file = SNAPSHOT_FILE + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]) + body)
+        os.replace(tmp_file, SNAPSHOT_FILE)
+        return True
+    except Exception as e:
+        print(f"Snapshot yozishda xato: {e}")
+        return False
+
+def load_snapshot():
+    """Snapshotni o'qiydi va undan keyingi o'zgarishlarni qo'shadi; yaroqsiz bo'lsa None"""
+    global mongo_resync
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return None
+
+    header = len(SNAPSHOT_MAGIC) + 1
+    if raw[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC or raw[header - 1] != SNAPSHOT_VERSION:
+        print("⚠️ Snapshot versiyasi mos emas, to'liq yuklanadi")
+        return None
+    try:
+        payload = pickle.loads(zlib.decompress(raw[header:]))
+        data = payload['data']
+    except Exception as e:
+        print(f"⚠️ Snapshot o'qilmadi: {e}")
+        return None
+
     try:
         if mongo_connected and users_col is not None:
-            for uid, u in data['users'].items():
-                users_col.update_one({'id': int(uid)}, {'$set': {
-                    'id': int(uid),
-                    'first_name': u.get('first_name', ''),
-                    'last_name': u.get('last_name', ''),
-                    'username': u.get('username', ''),
-                    'phone': u.get('phone', ''),
-                    'joined': u.get('joined', ''),
-                    'last_active': u.get('last_active', ''),
-                    'message_count': int(u.get('message_count', 0)),
-                    'is_admin': bool(u.get('is_admin', False))
-                }}, upsert=True)
-        save_json(data['users'], USERS_FILE)
-    except Exception:
-        save_json(data['users'], USERS_FILE)
+            # Faqat snapshotdan keyin faol bo'lgan foydalanuvchilar
+            updated = 0
+            for doc in users_col.find({'last_active': {'$gte': payload['sync_point']}}):
+                uid, user = user_from_doc(doc)
+                if uid in data['users']:
+                    merge_user(data['users'][uid], user)
+                else:
+                    data['users'][uid] = user
+                updated += 1
+            data['channels'] = load_channels()
+            print(f"✅ Snapshot yuklandi ({payload['created']}), Mongo dan {updated} ta yangilanish")
+        else:
+            # JSON fayllar snapshotdan keyin o'zgargan bo'lsa - to'liq yuklash
+            snapshot_mtime = os.path.getmtime(SNAPSHOT_FILE)
+            for filename in (USERS_FILE, CHANNELS_FILE):
+                if os.path.exists(filename) and os.path.getmtime(filename) > snapshot_mtime:
+                    print("⚠️ JSON fayllar snapshotdan yangiroq, to'liq yuklanadi")
+                    return None
+            print(f"✅ Snapshot yuklandi ({payload['created']})")
+    except Exception as e:
+        print(f"⚠️ Snapshotni yangilashda xato: {e}")
+        return None
 
-    # Channels
+    data['admins'] = safe_load_json(ADMINS_FILE, data.get('admins', DEFAULT_DATA['admins']))
+    if MAIN_ADMIN and MAIN_ADMIN not in data['admins']:
+        data['admins'].append(MAIN_ADMIN)
+    # Xabarlar logi har save_data da yoziladi - snapshotdagisi OOM/SIGKILL dan keyin eskirgan bo'ladi
+    # (va keyingi save_data messages.json ni shu eski ro'yxat bilan bosib ketardi); eski snapshotlarda
+    # cheklanmagan log bo'lishi mumkin
+    data['messages'] = safe_load_json(MESSAGES_FILE, data.get('messages', []))[-MESSAGES_LOAD_LIMIT:]
+    # Mongo ga yetib bormagan yozuvlar keyingi saqlashda qayta yoziladi
+    mark_users_dirty(payload.get('pending_mongo_users', []))
+    mongo_resync = mongo_resync or payload.get('mongo_resync', False)
+    return data
+
+# Oxirgi so'rovga Telegram qaytargan 429 retry_after (soniya) - har thread uchun alohida,
+# send_* funksiyalari faqat True/False qaytaradi
+telegram_local = threading.local()
+
+def last_retry_after():
+    return getattr(telegram_local, 'retry_after', 0)
+
+def telegram_request(method, payload=None, params=None, files=None, timeout=10):
+    """Bot API so'rovi circuit breaker orqali; breaker ochiq yoki xato bo'lsa None"""
+    telegram_local.retry_after = 0
+    if not telegram_breaker.allow():
+        return None
     try:
-        if mongo_connected and channels_col is not None:
-            for key, c in data['channels'].items():
-                channels_col.update_one({'username': c.get('username', key)}, {'$set': {
-                    'username': c.get('username', key),
-                    'name': c.get('name', key),
-                    'added_by': c.get('added_by'),
-                    'added_date': c.get('added_date')
-                }}, upsert=True)
-        save_json(data['channels'], CHANNELS_FILE)
+        url = BASE_URL + method
+        if async_transport is not None and files is None:
+            # Async runtime: handler thread umumiy aiohttp sessiyasidan foydalanadi
+            loop, session = async_transport
+            future = asyncio.run_coroutine_threadsafe(aiohttp_request(session, method, payload, params, timeout), loop)
+            response = future.result(timeout + 5)
+        elif payload is None and files is None:
+            response = requests.get(url, params=params, timeout=timeout)
+        else:
+            response = requests.post(url, json=payload, params=params, files=files, timeout=timeout)
     except Exception:
-        save_json(data['channels'], CHANNELS_FILE)
-
-    # Admins
-    save_json(data['admins'], ADMINS_FILE)
-    
-    # Messages
-    save_json(data.get('messages', [])[-200:], MESSAGES_FILE)
+        telegram_breaker.record(False)
+        return None
+    telegram_breaker.record(telegram_status_ok(response.status_code))
+    if response.status_code == 429:
+        try:
+            telegram_local.retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+        except Exception:
+            telegram_local.retry_after = 1
+    return response
+
+def telegram_status_ok(status_code):
+    # 5xx va 429 - xizmat muammosi; boshqa 4xx (bloklagan user va h.k.) - yo'q
+    return status_code < 500 and status_code != 429
+
+# aiohttp transport (BOT_RUNTIME=async)
+async_transport = None  # (event loop, aiohttp.ClientSession)
+
+class AsyncResponse:
+    """requests.Response ga o'xshash minimal javob (status_code, json())"""
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+async def aiohttp_request(session, method, payload=None, params=None, timeout=10):
+    url = BASE_URL + method
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    if payload is None:
+        async with session.get(url, params=params, timeout=client_timeout) as response:
+            return AsyncResponse(response.status, await response.read())
+    async with session.post(url, json=payload, params=params, timeout=client_timeout) as response:
+        return AsyncResponse(response.status, await response.read())
 
 def send_message(chat_id, text, reply_markup=None, parse_mode='HTML'):
     try:
-        url = BASE_URL + "sendMessage"
         payload = {
             'chat_id': chat_id, 
             'text': text, 
@@ -219,14 +831,13 @@ def send_message(chat_id, text, reply_markup=None, parse_mode='HTML'):
         if reply_markup:
             payload['reply_markup'] = json.dumps(reply_markup)
         
-        response = requests.post(url, json=payload, timeout=10)
-        return response.status_code == 200
+        response = telegram_request('sendMessage', payload)
+        return response is not None and response.status_code == 200
     except Exception:
         return False
 
 def send_photo(chat_id, photo, caption=None, reply_markup=None):
     try:
-        url = BASE_URL + "sendPhoto"
         payload = {
             'chat_id': chat_id,
             'photo': photo
@@ -237,45 +848,49 @@ def send_photo(chat_id, photo, caption=None, reply_markup=None):
         if reply_markup:
             payload['reply_markup'] = json.dumps(reply_markup)
         
-        response = requests.post(url, json=payload, timeout=10)
-        return response.status_code == 200
+        response = telegram_request('sendPhoto', payload)
+        return response is not None and response.status_code == 200
     except Exception:
         return False
 
 def copy_message(chat_id, from_chat_id, message_id):
     try:
-        url = BASE_URL + "copyMessage"
         payload = {
             'chat_id': chat_id,
             'from_chat_id': from_chat_id,
             'message_id': message_id
         }
-        response = requests.post(url, json=payload, timeout=10)
-        return response.status_code == 200
+        response = telegram_request('copyMessage', payload)
+        return response is not None and response.status_code == 200
     except Exception:
         return False
 
 def forward_message(chat_id, from_chat_id, message_id):
     try:
-        url = BASE_URL + "forwardMessage"
         payload = {'chat_id': chat_id, 'from_chat_id': from_chat_id, 'message_id': message_id}
-        response = requests.post(url, json=payload, timeout=10)
-        return response.status_code == 200
+        response = telegram_request('forwardMessage', payload)
+        return response is not None and response.status_code == 200
     except Exception:
         return False
 
-def get_updates(offset=None):
+def get_updates(offset=None, poll_timeout=60):
     try:
-        url = BASE_URL + "getUpdates"
+        # Telegram ishlamayapti - breaker sinov vaqtigacha kutamiz
+        if telegram_breaker.is_open():
+            telegram_breaker.wait(poll_timeout)
+            return []
+        # Sinov paytida long polling yagona sinov o'rnini band qilib turmasin - qisqa so'rov
+        if not telegram_breaker.is_closed():
+            poll_timeout = 0
         params = {
-            'timeout': 60,
+            'timeout': poll_timeout,
             'limit': 100,
         }
         if offset is not None:
             params['offset'] = offset
             
-        response = requests.get(url, params=params, timeout=65)
-        if response.status_code == 200:
+        response = telegram_request('getUpdates', params=params, timeout=poll_timeout + 5)
+        if response is not None and response.status_code == 200:
             return response.json().get('result', [])
         return []
     except Exception:
@@ -300,7 +915,7 @@ def user_menu(is_admin=False):
     return create_keyboard(buttons)
 
 def admin_menu():
-    buttons = ["📊 Statistika", "👥 Userlar ro'yxati", "📣 Hammaga xabar", "👨‍💻 Adminlar", "📢 Kanallar", "🔙 Foydalanuvchi menyusi"]
+    buttons = ["📊 Statistika", "👥 Userlar ro'yxati", "📣 Hammaga xabar", "🔎 Foydalanuvchi qidirish", "🔍 Xabar qidirish", "👨‍💻 Adminlar", "📢 Kanallar", "🔙 Foydalanuvchi menyusi"]
     return create_keyboard(buttons, 2)
 
 def admins_management_menu():
@@ -317,11 +932,13 @@ def get_stats(data):
     total_admins = len(data['admins'])
     total_channels = len(data['channels'])
     
-    # Faol foydalanuvchilar (oxirgi 7 kun)
+    # Faol foydalanuvchilar (oxirgi 7 kun) - "🟢 7 kunda faol" segmenti bilan bir xil chegara
     active_users = 0
-    one_week_ago = get_tashkent_time() - timedelta(days=7)
+    one_week_ago = get_tashkent_time() - timedelta(days=ACTIVE_DAYS)
     
-    for user in data['users'].values():
+    with state_lock:
+        users = list(data['users'].values())
+    for user in users:
         last_active = user.get('last_active', '')
         if last_active:
             try:
@@ -336,6 +953,9 @@ def get_stats(data):
     uptime_seconds = int((current_time - BOT_START_TIME).total_seconds())
     uptime_str = format_uptime(uptime_seconds)
 
+    # Mongo ga yozilishini kutayotganlar (bufer to'lgan bo'lsa - hammasi)
+    mongo_pending = total_users if mongo_resync else len(pending_mongo_users)
+
     return (
         "📊 <b>Bot statistikasi</b>\n\n"
         f"👥 <b>Jami foydalanuvchilar:</b> {total_users}\n"
@@ -346,6 +966,8 @@ def get_stats(data):
         f"🕒 <b>Bot ishga tushgan vaqti:</b> {BOT_START_TIME.strftime('%Y-%m-%d %H:%M:%S')}\n"
         f"⏱️ <b>Ishlash vaqti:</b> {uptime_str}\n"
         f"💾 <b>Ma'lumotlar manbai:</b> {'MongoDB' if mongo_connected else 'JSON fayllar'}\n"
+        f"🔄 <b>Mongo qayta ulanishlar:</b> {mongo_stats['reconnects']} "
+        f"(qayta yozilgan: {mongo_stats['replayed']}, navbatda: {mongo_pending})\n"
         f"🌏 <b>Mintaqa:</b> Toshkent (UTC+5)"
     )
 
@@ -356,7 +978,9 @@ def export_users_to_excel(chat_id, data):
             return
         
         users_list = []
-        for user_id, user in data['users'].items():
+        with state_lock:
+            users = list(data['users'].items())
+        for user_id, user in users:
             users_list.append({
                 'ID': user_id,
                 'Ism': user.get('first_name', ''),
@@ -376,7 +1000,7 @@ def export_users_to_excel(chat_id, data):
         with open(filename, 'rb') as f:
             files = {'document': f}
             params = {'chat_id': chat_id, 'caption': '📊 Foydalanuvchilar ro\'yxati'}
-            requests.post(f"{BASE_URL}sendDocument", params=params, files=files, timeout=30)
+            telegram_request('sendDocument', params=params, files=files, timeout=30)
             
         try:
             os.remove(filename)
@@ -386,38 +1010,353 @@ def export_users_to_excel(chat_id, data):
     except Exception:
         send_message(chat_id, "❌ Foydalanuvchilar ro'yxatini yuborishda xatolik yuz berdi!")
 
-def broadcast_message(chat_id, message_data, data):
+# Foydalanuvchilar indeksi - segmentlar va qidiruv butun ro'yxatni aylanmasdan topiladi
+class UserIndex:
+    def __init__(self):
+        self.active_by_day = {}   # 'YYYY-MM-DD' -> {user_id}
+        self.joined_by_day = {}
+        self.user_active_day = {}
+        self.user_joined_day = {}
+        self.with_username = set()
+        self.usernames = []       # saralangan (username, user_id) - prefiks qidiruvi uchun
+        self.user_username = {}
+        self.name_tokens = {}     # token -> {user_id}
+        self.sorted_tokens = []   # saralangan tokenlar - prefiks qidiruvi uchun
+        self.user_tokens = {}
+        self._bulk = False
+
+    def rebuild(self, users):
+        self.__init__()
+        # Boshlang'ich yuklashda ro'yxatlar bir marta saralanadi (insort o'rniga)
+        self._bulk = True
+        for user_id, user in users.items():
+            self.update(user_id, user)
+        self._bulk = False
+        self.usernames.sort()
+        self.sorted_tokens.sort()
+
+    def _move(self, buckets, days, user_id, day):
+        old = days.get(user_id)
+        if old == day:
+            return
+        if old is not None:
+            bucket = buckets.get(old)
+            if bucket is not None:
+                bucket.discard(user_id)
+                if not bucket:
+                    del buckets[old]
+        days[user_id] = day
+        buckets.setdefault(day, set()).add(user_id)
+
+    def update(self, user_id, user):
+        user_id = str(user_id)
+        self._move(self.active_by_day, self.user_active_day, user_id, (user.get('last_active') or '')[:10])
+        self._move(self.joined_by_day, self.user_joined_day, user_id, (user.get('joined') or '')[:10])
+        if user.get('username'):
+            self.with_username.add(user_id)
+        else:
+            self.with_username.discard(user_id)
+        self._update_username(user_id, (user.get('username') or '').lower())
+        self._update_tokens(user_id, set(tokenize(f"{user.get('first_name') or ''} {user.get('last_name') or ''}")))
+
+    def _update_username(self, user_id, username):
+        old = self.user_username.get(user_id)
+        if old == username:
+            return
+        if old:
+            i = bisect.bisect_left(self.usernames, (old, user_id))
+            if i < len(self.usernames) and self.usernames[i] == (old, user_id):
+                self.usernames.pop(i)
+        if username:
+            if self._bulk:
+                self.usernames.append((username, user_id))
+            else:
+                bisect.insort(self.usernames, (username, user_id))
+            self.user_username[user_id] = username
+        else:
+            self.user_username.pop(user_id, None)
+
+    def _update_tokens(self, user_id, tokens):
+        old = self.user_tokens.get(user_id, set())
+        if old == tokens:
+            return
+        for token in old - tokens:
+            users = self.name_tokens.get(token)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self.name_tokens[token]
+                    i = bisect.bisect_left(self.sorted_tokens, token)
+                    if i < len(self.sorted_tokens) and self.sorted_tokens[i] == token:
+                        self.sorted_tokens.pop(i)
+        for token in tokens - old:
+            if token not in self.name_tokens:
+                self.name_tokens[token] = set()
+                if self._bulk:
+                    self.sorted_tokens.append(token)
+                else:
+                    bisect.insort(self.sorted_tokens, token)
+            self.name_tokens[token].add(user_id)
+        if tokens:
+            self.user_tokens[user_id] = tokens
+        else:
+            self.user_tokens.pop(user_id, None)
+
+    def username_prefix(self, prefix, limit=None):
+        result = []
+        i = bisect.bisect_left(self.usernames, (prefix, ''))
+        while i < len(self.usernames) and self.usernames[i][0].startswith(prefix):
+            result.append(self.usernames[i][1])
+            if limit and len(result) >= limit:
+                break
+            i += 1
+        return result
+
+    def token_prefix(self, prefix):
+        result = set()
+        i = bisect.bisect_left(self.sorted_tokens, prefix)
+        while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(prefix):
+            result |= self.name_tokens[self.sorted_tokens[i]]
+            i += 1
+        return result
+
+    def search(self, query):
+        """ID, @username prefiksi yoki ism/familiya tokenlari bo'yicha qidiradi"""
+        query = query.strip().lower()
+        if not query:
+            return []
+        if query.lstrip('-').isdigit():
+            return [query]
+        if query.startswith('@'):
+            return self.username_prefix(query[1:]) if query[1:] else []
+
+        tokens = tokenize(query)
+        result = None
+        for token in tokens:
+            matched = self.token_prefix(token)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        result = result or set()
+        if len(tokens) == 1:
+            result |= set(self.username_prefix(tokens[0]))
+        return sorted(result)
+
+    def _since(self, buckets, day):
+        result = set()
+        for bucket_day, users in buckets.items():
+            if bucket_day >= day:
+                result |= users
+        return result
+
+    def active_since(self, cutoff, users):
+        """last_active >= cutoff ('YYYY-MM-DD HH:MM:SS'); faqat chegara kuni vaqt bo'yicha tekshiriladi"""
+        day = cutoff[:10]
+        result = self._since(self.active_by_day, day)
+        for user_id in self.active_by_day.get(day, ()):
+            if (users.get(user_id, {}).get('last_active') or '') < cutoff:
+                result.discard(user_id)
+        return result
+
+    def joined_since(self, day):
+        return self._since(self.joined_by_day, day)
+
+def tokenize(text):
+    return [token for token in re.split(r"[^\w']+", text.lower()) if token]
+
+user_index = UserIndex()
+
+# Faollik oynasi (kun) - statistika va segment uchun umumiy
+ACTIVE_DAYS = 7
+
+# Broadcast segmentlari: tugma matni -> segment kaliti
+BROADCAST_SEGMENTS = {
+    "👥 Hamma foydalanuvchilar": 'all',
+    "🟢 7 kunda faol bo'lganlar": 'active_7d',
+    "🆕 Shu oy qo'shilganlar": 'joined_month',
+    "📛 Username borlar": 'has_username',
+}
+
+def resolve_segment(segment, data):
+    """Segmentdagi foydalanuvchi ID lari (adminlarsiz)"""
+    now = get_tashkent_time()
+    with state_lock:
+        if segment == 'active_7d':
+            users = user_index.active_since(format_tashkent_time(now - timedelta(days=ACTIVE_DAYS)), data['users'])
+        elif segment == 'joined_month':
+            users = user_index.joined_since(now.strftime('%Y-%m-01'))
+        elif segment == 'has_username':
+            users = set(user_index.with_username)
+        else:
+            users = set(data['users'])
+        admins = {str(admin_id) for admin_id in data['admins']}
+        return [user_id for user_id in users - admins if user_id in data['users']]
+
+# Xabarlar indeksi - data['messages'] dagi tartib raqami (seq) bo'yicha
+class MessageIndex:
+    def __init__(self):
+        self.postings = {}   # token -> [seq, ...] (o'sish tartibida)
+        self.by_user = {}    # user_id -> [seq, ...]
+        self.size = 0
+
+    def rebuild(self, messages):
+        self.__init__()
+        for seq, msg in enumerate(messages):
+            self.add(seq, msg)
+
+    def add(self, seq, msg):
+        for token in set(tokenize(msg.get('text') or '')):
+            self.postings.setdefault(token, []).append(seq)
+        self.by_user.setdefault(str(msg.get('user_id')), []).append(seq)
+        self.size = max(self.size, seq + 1)
+
+    def search(self, messages, tokens=(), user_id=None, date_from=None, date_to=None):
+        """Mos xabarlar seq ro'yxati (eskidan yangiga)"""
+        lists = [self.postings.get(token, []) for token in tokens]
+        if user_id is not None:
+            lists.append(self.by_user.get(str(user_id), []))
+
+        # Xabarlar vaqt bo'yicha qo'shiladi - sana oralig'i seq oralig'iga aylanadi
+        lo = bisect.bisect_left(messages, date_from, key=lambda m: m.get('date', '')) if date_from else 0
+        hi = bisect.bisect_right(messages, date_to, key=lambda m: m.get('date', '')) if date_to else self.size
+        hi = min(hi, self.size)
+
+        if not lists:
+            return list(range(lo, hi))
+        lists.sort(key=len)
+        others = [set(seqs) for seqs in lists[1:]]
+        first = lists[0]
+        start = bisect.bisect_left(first, lo)
+        end = bisect.bisect_left(first, hi)
+        return [seq for seq in first[start:end] if all(seq in other for other in others)]
+
+message_index = MessageIndex()
+
+MESSAGE_SEARCH_PAGE = 10
+
+def parse_message_query(query):
+    """'so'z user:ID from:YYYY-MM-DD to:YYYY-MM-DD' ko'rinishidagi so'rovni ajratadi"""
+    words, user_id, date_from, date_to = [], None, None, None
+    for part in query.split():
+        key, _, value = part.partition(':')
+        key = key.lower()
+        if value and key == 'user':
+            user_id = value.lstrip('@')
+        elif value and key == 'from':
+            date_from = value
+        elif value and key == 'to':
+            date_to = value + ' 23:59:59' if len(value) == 10 else value
+        else:
+            words.append(part)
+    return tokenize(' '.join(words)), user_id, date_from, date_to
+
+def format_message_search(query, page, data):
+    tokens, user_id, date_from, date_to = parse_message_query(query)
+    if not tokens and user_id is None and not date_from and not date_to:
+        return "❌ Kalit so'z, user: yoki from:/to: kiriting", False
+
+    # Indekslarni boshqa handler'lar parallel yangilaydi - qidiruv va sahifani yig'ish qulf ostida
+    with state_lock:
+        if user_id is not None and not user_id.lstrip('-').isdigit():
+            found = user_index.username_prefix(user_id.lower())
+            user_id = found[0] if found else user_id
+        messages = data.get('messages', [])
+        result = message_index.search(messages, tokens, user_id, date_from, date_to)
+        if not result:
+            return "🔍 Xabar topilmadi", False
+
+        pages = (len(result) + MESSAGE_SEARCH_PAGE - 1) // MESSAGE_SEARCH_PAGE
+        page = max(1, min(page, pages))
+        end = len(result) - (page - 1) * MESSAGE_SEARCH_PAGE
+        chunk = reversed(result[max(0, end - MESSAGE_SEARCH_PAGE):end])  # yangilari birinchi
+
+        lines = [f"🔍 <b>Topildi:</b> {len(result)} (sahifa {page}/{pages})\n"]
+        for seq in chunk:
+            msg = messages[seq]
+            user = data['users'].get(str(msg.get('user_id')), {})
+            # Kesilgandan keyin escape - HTML entity yarmida uzilmaydi
+            name = html.escape(str(user.get('first_name') or msg.get('user_id')))
+            text = html.escape((msg.get('text') or '📎 Fayl/Rasm')[:200])
+            lines.append(f"🕒 {msg.get('date', '')} | 👤 {name} ({msg.get('user_id')})\n📝 {text}")
+    return "\n".join(lines), page < pages
+
+def message_search_menu(has_next=False):
+    buttons = (["➡️ Keyingi sahifa"] if has_next else []) + ["Bekor qilish", "🔙 Admin paneli"]
+    return create_keyboard(buttons)
+
+USER_SEARCH_LIMIT = 20
+
+def format_user_search(query, data):
+    with state_lock:
+        found = [user_id for user_id in user_index.search(query) if user_id in data['users']]
+        if not found:
+            return "🔎 Hech kim topilmadi"
+        lines = [f"🔎 <b>Topildi:</b> {len(found)}\n"]
+        for user_id in found[:USER_SEARCH_LIMIT]:
+            user = data['users'][user_id]
+            # Ism va username foydalanuvchi kiritgan - HTML sifatida talqin qilinmasin
+            name = html.escape(f"{user.get('first_name', '')} {user.get('last_name', '')}".strip() or 'Nomalum')
+            username = f" @{html.escape(user.get('username'))}" if user.get('username') else ""
+            lines.append(f"👤 {name}{username} (ID: {user_id})\n🕒 {user.get('last_active', '')}")
+    if len(found) > USER_SEARCH_LIMIT:
+        lines.append(f"\n... va yana {len(found) - USER_SEARCH_LIMIT} ta")
+    return "\n".join(lines)
+
+BROADCAST_CONFIRM = "✅ Yuborish"
+
+# Handler holatlari (awaiting_*, broadcast_*) qulf ostida o'zgaradi - save_json userlarni yozayotganda
+# lug'at o'lchami o'zgarsa dump xato bilan to'xtaydi va users.json yozilmay qoladi
+def set_user_state(user, **values):
+    with state_lock:
+        user.update(values)
+
+def pop_user_state(user, key, default=None):
+    with state_lock:
+        return user.pop(key, default)
+
+def broadcast_segment_menu():
+    return create_keyboard(list(BROADCAST_SEGMENTS) + ["Bekor qilish", "🔙 Admin paneli"], 2)
+
+def broadcast_message(chat_id, message_data, data, segment='all'):
     """Rasmli postlarni ham yubora oladigan broadcast funksiyasi"""
     try:
-        total_users = len(data['users'])
-        send_message(chat_id, f"📣 Xabar {total_users} foydalanuvchiga yuborilmoqda...")
+        recipients = resolve_segment(segment, data)
+        send_message(chat_id, f"📣 Xabar {len(recipients)} foydalanuvchiga yuborilmoqda...")
         
         success = 0
         failed = 0
+        paused = 0
+        
+        if message_data['type'] == 'text':
+            # Oddiy matnli xabar
+            deliver = lambda uid: send_message(uid, message_data['text'])
+        elif message_data['type'] == 'photo':
+            # Rasmli xabar
+            deliver = lambda uid: send_photo(uid, message_data['photo'], message_data.get('caption'))
+        else:
+            # Forward qilingan xabar
+            deliver = lambda uid: forward_message(uid, message_data['from_chat_id'], message_data['message_id'])
         
-        for user_id in list(data['users'].keys()):
+        for user_id in recipients:
             try:
-                if int(user_id) not in data['admins']:  # Adminlarga yubormaymiz
-                    if message_data['type'] == 'text':
-                        # Oddiy matnli xabar
-                        if send_message(int(user_id), message_data['text']):
-                            success += 1
-                        else:
-                            failed += 1
-                    elif message_data['type'] == 'photo':
-                        # Rasmli xabar
-                        if send_photo(int(user_id), message_data['photo'], message_data.get('caption')):
-                            success += 1
-                        else:
-                            failed += 1
-                    elif message_data['type'] == 'forward':
-                        # Forward qilingan xabar
-                        if forward_message(int(user_id), message_data['from_chat_id'], message_data['message_id']):
-                            success += 1
-                        else:
-                            failed += 1
-                    
-                    time.sleep(0.1)  # Rate limit
+                while True:
+                    # Telegram ishlamayapti yoki sinov ketmoqda - userlarni "xato" bilan o'tkazib yubormasdan kutamiz
+                    paused += telegram_breaker.wait_ready()
+                    if deliver(int(user_id)):
+                        success += 1
+                        break
+                    # 429 - Telegram aytgan vaqtcha kutib shu userga qayta yuboramiz (breaker yopiq bo'lsa ham)
+                    retry_after = last_retry_after()
+                    if retry_after:
+                        time.sleep(retry_after)
+                        paused += retry_after
+                        continue
+                    # Breaker yopiq - haqiqiy xato (bloklagan user va h.k.); aks holda kutib qayta urinamiz
+                    if telegram_breaker.is_closed():
+                        failed += 1
+                        break
+                
+                time.sleep(BROADCAST_DELAY)  # Rate limit
             except Exception as e:
                 print(f"Xabar yuborishda xato user {user_id}: {e}")
                 failed += 1
@@ -425,24 +1364,178 @@ def broadcast_message(chat_id, message_data, data):
         send_message(chat_id, 
                     f"📣 <b>Xabar yuborish yakunlandi!</b>\n\n"
                     f"✅ <b>Muvaffaqiyatli:</b> {success}\n"
-                    f"❌ <b>Xatolar:</b> {failed}", 
+                    f"❌ <b>Xatolar:</b> {failed}"
+                    + (f"\n⏸ <b>Telegram pauzasi:</b> {int(paused)}s" if paused else ""), 
                     reply_markup=admin_menu())
     except Exception as e:
         print(f"Broadcast xatosi: {e}")
         send_message(chat_id, "❌ Xabar tarqatishda xatolik yuz berdi!")
 
+# Xotira diagnostikasi
+def deep_sizeof(obj):
+    """Obyektning taxminiy to'liq hajmi (baytlarda), ichki obyektlar bilan"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+def is_shared_value(value):
+    # Interpretator bitta nusxada saqlaydigan qiymatlar (None, bool, kichik int, bo'sh satr)
+    return value is None or value == '' or isinstance(value, bool) or (type(value) is int and -5 <= value <= 256)
+
+MEMORY_REPORT_CHUNK = 10000
+
+def users_sizeof(users):
+    """users hajmi va awaiting_* hisoblagichlari nusxa olmasdan. deep_sizeof ning seen to'plami 1M userda
+    yuzlab MB oladi - kalit nomlari barcha userlarda umumiy, ular bir marta hisoblanadi. Qulf bo'laklab
+    olinadi - handlerlar butun hisob davomida to'xtab qolmasin"""
+    with state_lock:
+        uids = list(users)
+    total = sys.getsizeof(users)
+    keys = set()
+    awaiting = {}
+    for start in range(0, len(uids), MEMORY_REPORT_CHUNK):
+        with state_lock:
+            for uid in uids[start:start + MEMORY_REPORT_CHUNK]:
+                user = users.get(uid)
+                if user is None:
+                    continue
+                total += sys.getsizeof(uid) + sys.getsizeof(user)
+                keys.update(user)
+                for value in user.values():
+                    if isinstance(value, (dict, list)):
+                        total += deep_sizeof(value)
+                    elif not is_shared_value(value):
+                        total += sys.getsizeof(value)
+                for key in AWAITING_SET.intersection(user):
+                    if user[key]:
+                        awaiting[key] = awaiting.get(key, 0) + 1
+    return total + sum(sys.getsizeof(key) for key in keys), awaiting
+
+def memory_report():
+    data = bot_data or {}
+    # Handlerlar ma'lumotni o'zgartirayotgan bo'lishi mumkin - o'qish qulf ostida, lekin nusxasiz
+    # (nusxa 1M userda ~300 MB - 512 MB instansiyada diagnostikaning o'zi OOM ga olib kelardi)
+    users = data.get('users', {})
+    users_bytes, awaiting = users_sizeof(users)
+    with state_lock:
+        messages = data.get('messages', [])
+        structures = {
+            'users': {'count': len(users), 'bytes': users_bytes},
+            'messages': {'count': len(messages), 'bytes': deep_sizeof(messages)},
+            'forwarded_messages': {'count': len(forwarded_messages),
+                                   'bytes': sys.getsizeof(forwarded_messages) +
+                                            sum(sys.getsizeof(m) for m in forwarded_messages)},
+            'awaiting_flags': {'count': sum(awaiting.values()), 'by_key': awaiting}
+        }
+
+    return {
+        'time': format_tashkent_time(),
+        'structures': structures,
+        'mongo': dict(mongo_stats, connected=mongo_connected, pending_users=len(pending_mongo_users),
+                      resync=mongo_resync, breaker=mongo_breaker.stats),
+        'tracemalloc': tracemalloc.is_tracing()
+    }
+
+_last_snapshot = None
+_trace_timer = None
+_snapshot_lock = threading.Lock()
+
+def tracemalloc_diff(limit=20):
+    """Oldingi chaqiruvdan beri xotira o'zgarishlari (birinchi chaqiruv kuzatishni boshlaydi)"""
+    global _last_snapshot, _trace_timer
+    with _snapshot_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _last_snapshot = tracemalloc.take_snapshot()
+            # Kuzatish xotira oladi - unutilgan sessiya DEBUG_TRACE_TTL dan keyin to'xtaydi
+            _trace_timer = threading.Timer(DEBUG_TRACE_TTL, stop_tracemalloc)
+            _trace_timer.daemon = True
+            _trace_timer.start()
+            return {'started': True, 'expires_in': DEBUG_TRACE_TTL, 'diff': []}
+
+        snapshot = tracemalloc.take_snapshot()
+        previous = _last_snapshot
+        _last_snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        result = {'started': False, 'current_bytes': current, 'peak_bytes': peak, 'diff': []}
+        if previous is None:
+            return result
+
+        for stat in snapshot.compare_to(previous, 'lineno')[:limit]:
+            frame = stat.traceback[0]
+            result['diff'].append({
+                'location': f"{frame.filename}:{frame.lineno}",
+                'size_diff': stat.size_diff,
+                'size': stat.size,
+                'count_diff': stat.count_diff
+            })
+        return result
+
+def stop_tracemalloc():
+    """tracemalloc sessiyasini to'xtatadi; sessiya bo'lgan bo'lsa True"""
+    global _last_snapshot, _trace_timer
+    with _snapshot_lock:
+        if _trace_timer is not None:
+            _trace_timer.cancel()
+            _trace_timer = None
+        _last_snapshot = None
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        return True
+
 # Soddalashtirilgan Health server
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path in ['/', '/health', '/status']:
+        url = urlsplit(self.path)
+        if url.path in ['/', '/health', '/status']:
             self.send_response(200)
             self.send_header('Content-type', 'text/plain')
             self.end_headers()
             self.wfile.write(b'@codermrxbot ishlayapti ...')
+        elif url.path == '/debug/memory' and self.is_debug_allowed(url):
+            params = parse_qs(url.query)
+            report = memory_report()
+            if params.get('stop', ['0'])[0] == '1':
+                report['tracemalloc_stopped'] = stop_tracemalloc()
+                report['tracemalloc'] = False
+            elif params.get('snapshot', ['0'])[0] == '1':
+                try:
+                    limit = int(params.get('limit', ['20'])[0])
+                except ValueError:
+                    limit = 20
+                report['snapshot'] = tracemalloc_diff(limit)
+            self.send_json(report)
         else:
             self.send_response(404)
             self.end_headers()
     
+    def is_debug_allowed(self, url):
+        if not DEBUG_TOKEN:
+            return False
+        token = self.headers.get('X-Debug-Token') or parse_qs(url.query).get('token', [''])[0]
+        return hmac.compare_digest(token.encode('utf-8'), DEBUG_TOKEN.encode('utf-8'))
+
+    def send_json(self, payload):
+        body = json.dumps(payload, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, format, *args):
         pass  # HTTP loglarini o'chirish
 
@@ -467,6 +1560,16 @@ def save_next_offset(offset):
     except Exception:
         pass
 
+def load_inflight_updates():
+    """Oldingi ishga tushishda tugallanmay qolgan update'lar (update_id tartibida)"""
+    updates = safe_load_json(INFLIGHT_FILE, [])
+    if not isinstance(updates, list):
+        return []
+    return sorted((u for u in updates if isinstance(u, dict) and 'update_id' in u), key=lambda u: u['update_id'])
+
+def save_inflight_updates(updates):
+    save_json(updates, INFLIGHT_FILE)
+
 def ensure_no_webhook():
     try:
         requests.get(BASE_URL + "deleteWebhook", timeout=5)
@@ -509,6 +1612,13 @@ def self_ping():
 # Track forwarded messages to avoid duplicates
 forwarded_messages = set()
 
+# Admin kutish holatlari (foydalanuvchi yozuvida saqlanadi)
+AWAITING_KEYS = ('awaiting_broadcast', 'awaiting_broadcast_segment', 'awaiting_broadcast_confirm', 'awaiting_user_search', 'awaiting_message_search', 'awaiting_channel_add', 'awaiting_admin_add', 'awaiting_admin_remove', 'awaiting_channel_remove')
+AWAITING_SET = frozenset(AWAITING_KEYS)
+
+# Joriy ma'lumotlar (health server diagnostikasi uchun)
+bot_data = None
+
 # Commandlar ro'yxati - bu commandlar adminga yuborilmaydi
 USER_COMMANDS = {
     '/start', '/help', '/yordam',
@@ -525,6 +1635,92 @@ def is_user_command(text):
     text_lower = text.lower().strip()
     return text_lower in USER_COMMANDS
 
+# Per-user flood control (token bucket) va xabarlarni jamlash
+class FloodControl:
+    def __init__(self, rate, burst, window):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.buckets = {}   # user_id -> (tokens, oxirgi vaqt)
+        self.pending = {}   # user_id -> cheklangan xabarlar to'plami
+        self.last_ack = {}  # user_id -> oxirgi tasdiq vaqti
+
+    def allow(self, user_id, now):
+        tokens, last = self.buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self.buckets[user_id] = (tokens - 1, now)
+            return True
+        self.buckets[user_id] = (tokens, now)
+        return False
+
+    def throttle(self, user_id, chat_id, text, now, media_id=None):
+        """Cheklangan xabarni jamlaydi; burstdagi birinchi xabar bo'lsa True
+
+        media_id - rasm/fayl xabarining message_id si: to'plam yuborilganda adminlarga forward qilinadi.
+        """
+        entry = self.pending.get(user_id)
+        first = entry is None
+        if first:
+            entry = self.pending[user_id] = {'chat_id': chat_id, 'count': 0, 'texts': [], 'media': [],
+                                             'media_dropped': 0, 'first': now}
+        entry['count'] += 1
+        entry['last'] = now
+        entry['texts'] = (entry['texts'] + [text])[-5:]
+        if media_id is not None:
+            if len(entry['media']) < FLOOD_MEDIA_MAX:
+                entry['media'].append(media_id)
+            else:
+                entry['media_dropped'] += 1
+        return first
+
+    def should_ack(self, user_id, now):
+        """Qabul qilindi xabari oynada bir marta yuboriladi"""
+        if now - self.last_ack.get(user_id, 0) < self.window:
+            return False
+        self.last_ack[user_id] = now
+        return True
+
+    def due(self, now):
+        """Jamlash oynasi tugagan to'plamlar; to'lgan bucketlar tozalanadi"""
+        ready = [(uid, e) for uid, e in self.pending.items() if now - e['last'] >= self.window]
+        for uid, _ in ready:
+            del self.pending[uid]
+        idle = self.burst / self.rate if self.rate > 0 else self.window
+        for uid in [uid for uid, (_, last) in self.buckets.items() if now - last > idle]:
+            del self.buckets[uid]
+            self.last_ack.pop(uid, None)
+        return ready
+
+flood_control = FloodControl(FLOOD_RATE, FLOOD_BURST, FLOOD_WINDOW)
+
+def flush_flood_notifications(data):
+    """Cheklangan xabarlar to'plamini adminlarga bitta xabar qilib yuboradi"""
+    with state_lock:
+        ready = flood_control.due(time.time())
+    for user_id_str, entry in ready:
+        user_info = data['users'].get(user_id_str, {})
+        texts = "\n".join(f"• {html.escape(t[:100])}" for t in entry['texts'])
+        # Ism va username foydalanuvchi kiritgan - "<" bo'lsa Telegram 400 qaytaradi va xulosa yo'qoladi
+        name = html.escape(f"{user_info.get('first_name','')} {user_info.get('last_name','')}")
+        username = html.escape(user_info.get('username') or 'noma`lum')
+        media = entry.get('media', [])
+        dropped = entry.get('media_dropped', 0)
+        for admin_id in data['admins']:
+            send_message(admin_id,
+                        f"📨 <b>Ko'p xabar ({entry['count']} ta, cheklangan)</b>\n"
+                        f"👤: {name}\n"
+                        f"📱: @{username}\n"
+                        f"🆔: {user_id_str}\n"
+                        f"📝 Oxirgilari:\n{texts}"
+                        + (f"\n📎 Fayl/Rasm: {len(media)} ta quyida" if media else "")
+                        + (f" (yana {dropped} tasi yuborilmadi)" if dropped else ""))
+            # Cheklangan rasm/fayllar yo'qolmasin - xulosadan keyin asl holida
+            for media_id in media:
+                forward_message(admin_id, entry['chat_id'], media_id)
+    if ready:
+        save_data(data)
+
 # Asosiy message processor
 def process_message(update, data):
     try:
@@ -545,29 +1741,53 @@ def process_message(update, data):
         user_id_str = str(user_id)
         current_time = format_tashkent_time()
         
-        # User ma'lumotlarini yangilash
-        if user_id_str not in data['users']:
-            data['users'][user_id_str] = {
-                'id': user_id,
-                'first_name': message.get('from', {}).get('first_name', ''),
-                'last_name': message.get('from', {}).get('last_name', ''),
-                'username': message.get('from', {}).get('username', ''),
-                'phone': message.get('contact', {}).get('phone_number', '') if 'contact' in message else '',
-                'joined': current_time,
-                'last_active': current_time,
-                'message_count': 1,
-                'is_admin': user_id in data['admins']
-            }
-        else:
-            data['users'][user_id_str]['last_active'] = current_time
-            data['users'][user_id_str]['message_count'] = data['users'][user_id_str].get('message_count', 0) + 1
-
-        # Xabarni saqlash
-        data['messages'].append({
-            'user_id': user_id,
-            'text': text,
-            'date': current_time
-        })
+        with state_lock:
+            # User ma'lumotlarini yangilash
+            if user_id_str not in data['users']:
+                data['users'][user_id_str] = {
+                    'id': user_id,
+                    'first_name': message.get('from', {}).get('first_name', ''),
+                    'last_name': message.get('from', {}).get('last_name', ''),
+                    'username': message.get('from', {}).get('username', ''),
+                    'phone': message.get('contact', {}).get('phone_number', '') if 'contact' in message else '',
+                    'joined': current_time,
+                    'last_active': current_time,
+                    'message_count': 1,
+                    'is_admin': user_id in data['admins']
+                }
+            else:
+                user = data['users'][user_id_str]
+                user['last_active'] = current_time
+                user['message_count'] = user.get('message_count', 0) + 1
+                # Profil o'zgarishlari (ism, username) - qidiruv indeksi uchun
+                sender = message.get('from', {})
+                for field in ('first_name', 'last_name', 'username'):
+                    if user.get(field, '') != sender.get(field, ''):
+                        user[field] = sender.get(field, '')
+            user_index.update(user_id_str, data['users'][user_id_str])
+            mark_users_dirty((user_id_str,))
+
+            # Xabarni saqlash (admin qidiruv so'rovi logga tushmaydi - aks holda o'zini topadi)
+            if not data['users'][user_id_str].get('awaiting_message_search'):
+                data['messages'].append({
+                    'user_id': user_id,
+                    'text': text,
+                    'date': current_time
+                })
+                message_index.add(len(data['messages']) - 1, data['messages'][-1])
+
+        # Flood control - limitdan oshgan xabarlar jamlanadi, saqlash va yuborish keyinroq
+        if user_id not in data['admins']:
+            now = time.time()
+            with state_lock:
+                throttled = not flood_control.allow(user_id_str, now)
+                media_id = message_id if (message.get('photo') or message.get('document')) else None
+                first = throttled and flood_control.throttle(user_id_str, chat_id, text or message.get('caption') or "📎 Fayl/Rasm",
+                                                             now, media_id)
+            if throttled:
+                if first:
+                    send_message(chat_id, "⏳ Juda tez yozyapsiz. Xabarlaringiz qabul qilindi va adminlarga jamlab yuboriladi.")
+                return data
 
         # Command processing
         if text == "/start":
@@ -589,8 +1809,9 @@ def process_message(update, data):
             # Clear awaiting states
             if user_id_str in data['users']:
                 user_data = data['users'][user_id_str]
-                for key in ['awaiting_broadcast', 'awaiting_channel_add', 'awaiting_admin_add', 'awaiting_admin_remove', 'awaiting_channel_remove']:
-                    user_data.pop(key, None)
+                with state_lock:
+                    for key in AWAITING_KEYS + ('broadcast_segment', 'broadcast_pending', 'message_search'):
+                        user_data.pop(key, None)
             send_message(chat_id, "Admin paneliga qaytildi:", admin_menu())
             save_data(data)
             return data
@@ -632,11 +1853,33 @@ def process_message(update, data):
             
             elif text == "📣 Hammaga xabar":
                 send_message(chat_id, 
-                            "📣 <b>Hammaga yuboriladigan xabarni yuboring:</b>\n\n"
-                            "Matn, rasm yoki boshqa kontent yuborishingiz mumkin\n\n"
+                            "📣 <b>Xabar kimlarga yuborilsin?</b>\n\n"
+                            "Segmentni tanlang yoki <b>Bekor qilish</b> tugmasini bosing", 
+                            reply_markup=broadcast_segment_menu())
+                set_user_state(data['users'][user_id_str], awaiting_broadcast_segment=True)
+                save_data(data)
+                return data
+            
+            elif text == "🔎 Foydalanuvchi qidirish":
+                send_message(chat_id, 
+                            "🔎 <b>Qidiruv so'rovini yuboring:</b>\n\n"
+                            "ID, @username (boshi) yoki ism/familiya\n\n"
                             "Yoki <b>Bekor qilish</b> tugmasini bosing", 
                             reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
-                data['users'][user_id_str]['awaiting_broadcast'] = True
+                set_user_state(data['users'][user_id_str], awaiting_user_search=True)
+                save_data(data)
+                return data
+            
+            elif text == "🔍 Xabar qidirish":
+                send_message(chat_id, 
+                            "🔍 <b>Xabarlarni qidirish:</b>\n\n"
+                            "Kalit so'zlar va filtrlar:\n"
+                            "<code>user:ID</code> yoki <code>user:@username</code>\n"
+                            "<code>from:YYYY-MM-DD</code> <code>to:YYYY-MM-DD</code>\n"
+                            "<b>Misol:</b> narx user:123456 from:2024-01-01\n\n"
+                            "Yoki <b>Bekor qilish</b> tugmasini bosing", 
+                            reply_markup=message_search_menu())
+                set_user_state(data['users'][user_id_str], awaiting_message_search=True)
                 save_data(data)
                 return data
             
@@ -655,7 +1898,7 @@ def process_message(update, data):
                             "👨‍💻 <b>Yangi admin ID sini yuboring:</b>\n\n"
                             "Yoki <b>Bekor qilish</b> tugmasini bosing", 
                             reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
-                data['users'][user_id_str]['awaiting_admin_add'] = True
+                set_user_state(data['users'][user_id_str], awaiting_admin_add=True)
                 save_data(data)
                 return data
             
@@ -664,7 +1907,7 @@ def process_message(update, data):
                             "👨‍💻 <b>O'chiriladigan admin ID sini yuboring:</b>\n\n"
                             "Yoki <b>Bekor qilish</b> tugmasini bosing", 
                             reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
-                data['users'][user_id_str]['awaiting_admin_remove'] = True
+                set_user_state(data['users'][user_id_str], awaiting_admin_remove=True)
                 save_data(data)
                 return data
             
@@ -690,7 +1933,7 @@ def process_message(update, data):
                             "CoderMrx | codermrx\n\n"
                             "Yoki <b>Bekor qilish</b> tugmasini bosing", 
                             reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
-                data['users'][user_id_str]['awaiting_channel_add'] = True
+                set_user_state(data['users'][user_id_str], awaiting_channel_add=True)
                 save_data(data)
                 return data
             
@@ -699,7 +1942,7 @@ def process_message(update, data):
                             "📢 <b>O'chiriladigan kanal username ni yuboring:</b>\n\n"
                             "Yoki <b>Bekor qilish</b> tugmasini bosing", 
                             reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
-                data['users'][user_id_str]['awaiting_channel_remove'] = True
+                set_user_state(data['users'][user_id_str], awaiting_channel_remove=True)
                 save_data(data)
                 return data
             
@@ -719,15 +1962,40 @@ def process_message(update, data):
             # Awaiting handlers for admin actions
             user_data = data['users'].get(user_id_str, {})
             
+            # Broadcast segment handler
+            if user_data.get('awaiting_broadcast_segment'):
+                if text in ("Bekor qilish", "🔙 Admin paneli"):
+                    pop_user_state(user_data, 'awaiting_broadcast_segment')
+                    send_message(chat_id, "❌ Xabar yuborish bekor qilindi", reply_markup=admin_menu())
+                elif text in BROADCAST_SEGMENTS:
+                    segment = BROADCAST_SEGMENTS[text]
+                    audience = len(resolve_segment(segment, data))
+                    pop_user_state(user_data, 'awaiting_broadcast_segment')
+                    if audience:
+                        set_user_state(user_data, broadcast_segment=segment, awaiting_broadcast=True)
+                        send_message(chat_id, 
+                                    f"👥 <b>Auditoriya:</b> {audience} foydalanuvchi\n\n"
+                                    "📣 <b>Yuboriladigan xabarni yuboring:</b>\n"
+                                    "Matn, rasm yoki boshqa kontent yuborishingiz mumkin\n\n"
+                                    "Yoki <b>Bekor qilish</b> tugmasini bosing", 
+                                    reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
+                    else:
+                        send_message(chat_id, "⚠️ Bu segmentda foydalanuvchilar yo'q", reply_markup=admin_menu())
+                else:
+                    send_message(chat_id, "❌ Segmentni tugmalardan tanlang", reply_markup=broadcast_segment_menu())
+                save_data(data)
+                return data
+
             # Broadcast message handler
-            if user_data.get('awaiting_broadcast'):
+            elif user_data.get('awaiting_broadcast'):
                 if text in ("Bekor qilish", "🔙 Admin paneli"):
-                    user_data.pop('awaiting_broadcast', None)
+                    pop_user_state(user_data, 'awaiting_broadcast')
+                    pop_user_state(user_data, 'broadcast_segment')
                     send_message(chat_id, "❌ Xabar yuborish bekor qilindi", reply_markup=admin_menu())
                     save_data(data)
                 else:
-                    user_data.pop('awaiting_broadcast', None)
-                    save_data(data)
+                    pop_user_state(user_data, 'awaiting_broadcast')
+                    segment = pop_user_state(user_data, 'broadcast_segment', 'all')
                     
                     # Xabar turini aniqlash
                     message_data = {}
@@ -755,85 +2023,137 @@ def process_message(update, data):
                             'message_id': message_id
                         }
                     
-                    broadcast_message(chat_id, message_data, data)
+                    # Yuborishdan oldin auditoriya hajmi ko'rsatiladi va tasdiq so'raladi
+                    audience = len(resolve_segment(segment, data))
+                    set_user_state(user_data, broadcast_pending={'segment': segment, 'message': message_data},
+                                   awaiting_broadcast_confirm=True)
+                    send_message(chat_id, 
+                                f"📣 <b>Xabar {audience} foydalanuvchiga yuboriladi.</b>\n\n"
+                                "Tasdiqlaysizmi?", 
+                                reply_markup=create_keyboard([BROADCAST_CONFIRM, "Bekor qilish"]))
+                    save_data(data)
+                return data
+            
+            # Broadcast confirm handler
+            elif user_data.get('awaiting_broadcast_confirm'):
+                pop_user_state(user_data, 'awaiting_broadcast_confirm')
+                pending = pop_user_state(user_data, 'broadcast_pending')
+                save_data(data)
+                if text == BROADCAST_CONFIRM and pending:
+                    broadcast_message(chat_id, pending['message'], data, pending['segment'])
+                else:
+                    send_message(chat_id, "❌ Xabar yuborish bekor qilindi", reply_markup=admin_menu())
+                return data
+            
+            # User search handler
+            elif user_data.get('awaiting_user_search'):
+                pop_user_state(user_data, 'awaiting_user_search')
+                if text in ("Bekor qilish", "🔙 Admin paneli"):
+                    send_message(chat_id, "❌ Qidiruv bekor qilindi", reply_markup=admin_menu())
+                else:
+                    send_message(chat_id, format_user_search(text, data), reply_markup=admin_menu())
+                save_data(data)
+                return data
+            
+            # Message search handler (sahifalash uchun holat saqlanib qoladi)
+            elif user_data.get('awaiting_message_search'):
+                if text in ("Bekor qilish", "🔙 Admin paneli"):
+                    pop_user_state(user_data, 'awaiting_message_search')
+                    pop_user_state(user_data, 'message_search')
+                    send_message(chat_id, "❌ Qidiruv bekor qilindi", reply_markup=admin_menu())
+                else:
+                    previous = user_data.get('message_search')
+                    if text == "➡️ Keyingi sahifa" and previous:
+                        query, page = previous['query'], previous['page'] + 1
+                    else:
+                        query, page = text, 1
+                    result, has_next = format_message_search(query, page, data)
+                    set_user_state(user_data, message_search={'query': query, 'page': page})
+                    send_message(chat_id, result, reply_markup=message_search_menu(has_next))
+                save_data(data)
                 return data
             
             # Add admin handler
             elif user_data.get('awaiting_admin_add'):
                 if text in ("Bekor qilish", "🔙 Admin paneli"):
-                    user_data.pop('awaiting_admin_add', None)
+                    pop_user_state(user_data, 'awaiting_admin_add')
                     send_message(chat_id, "❌ Admin qo'shish bekor qilindi", reply_markup=admin_menu())
                 else:
                     try:
                         new_admin = int(text)
                         if new_admin not in data['admins']:
-                            data['admins'].append(new_admin)
+                            with state_lock:
+                                data['admins'].append(new_admin)
                             send_message(chat_id, f"✅ {new_admin} admin qo'shildi", reply_markup=admin_menu())
                         else:
                             send_message(chat_id, "⚠️ Bu foydalanuvchi allaqachon admin", reply_markup=admin_menu())
                     except ValueError:
                         send_message(chat_id, "❌ Noto'g'ri ID format", reply_markup=admin_menu())
-                    user_data.pop('awaiting_admin_add', None)
+                    pop_user_state(user_data, 'awaiting_admin_add')
                 save_data(data)
                 return data
             
             # Remove admin handler
             elif user_data.get('awaiting_admin_remove'):
                 if text in ("Bekor qilish", "🔙 Admin paneli"):
-                    user_data.pop('awaiting_admin_remove', None)
+                    pop_user_state(user_data, 'awaiting_admin_remove')
                     send_message(chat_id, "❌ Admin o'chirish bekor qilindi", reply_markup=admin_menu())
                 else:
                     try:
                         rem_admin = int(text)
                         if rem_admin in data['admins'] and rem_admin != MAIN_ADMIN:
-                            data['admins'].remove(rem_admin)
+                            with state_lock:
+                                data['admins'].remove(rem_admin)
                             send_message(chat_id, f"✅ {rem_admin} adminlikdan olindi", reply_markup=admin_menu())
                         else:
                             send_message(chat_id, "❌ Admin topilmadi yoki asosiy adminni o'chirib bo'lmaydi", reply_markup=admin_menu())
                     except ValueError:
                         send_message(chat_id, "❌ Noto'g'ri ID format", reply_markup=admin_menu())
-                    user_data.pop('awaiting_admin_remove', None)
+                    pop_user_state(user_data, 'awaiting_admin_remove')
                 save_data(data)
                 return data
             
             # Add channel handler
             elif user_data.get('awaiting_channel_add'):
                 if text in ("Bekor qilish", "🔙 Admin paneli"):
-                    user_data.pop('awaiting_channel_add', None)
+                    pop_user_state(user_data, 'awaiting_channel_add')
                     send_message(chat_id, "❌ Kanal qo'shish bekor qilindi", reply_markup=admin_menu())
                 else:
                     parts = text.split('|')
                     if len(parts) == 2:
                         name = parts[0].strip()
                         username = parts[1].strip().lstrip('@')
-                        data['channels'][username] = {
-                            'username': username,
-                            'name': name,
-                            'added_by': user_id,
-                            'added_date': current_time
-                        }
+                        with state_lock:
+                            data['channels'][username] = {
+                                'username': username,
+                                'name': name,
+                                'added_by': user_id,
+                                'added_date': current_time
+                            }
+                            mark_channels_dirty()
                         send_message(chat_id, f"✅ Kanal qo'shildi: {name} (@{username})", reply_markup=admin_menu())
                     else:
                         send_message(chat_id, "❌ Noto'g'ri format. Iltimos: Kanal nomi | username", 
                                    reply_markup=create_keyboard(["Bekor qilish", "🔙 Admin paneli"]))
                         return data
-                    user_data.pop('awaiting_channel_add', None)
+                    pop_user_state(user_data, 'awaiting_channel_add')
                 save_data(data)
                 return data
             
             # Remove channel handler
             elif user_data.get('awaiting_channel_remove'):
                 if text in ("Bekor qilish", "🔙 Admin paneli"):
-                    user_data.pop('awaiting_channel_remove', None)
+                    pop_user_state(user_data, 'awaiting_channel_remove')
                     send_message(chat_id, "❌ Kanal o'chirish bekor qilindi", reply_markup=admin_menu())
                 else:
                     channel_id = text.strip().lstrip('@')
                     if channel_id in data['channels']:
-                        del data['channels'][channel_id]
+                        with state_lock:
+                            data['channels'].pop(channel_id, None)
                         send_message(chat_id, f"✅ @{channel_id} kanali o'chirildi", reply_markup=admin_menu())
                     else:
                         send_message(chat_id, "❌ Kanal topilmadi", reply_markup=admin_menu())
-                    user_data.pop('awaiting_channel_remove', None)
+                    pop_user_state(user_data, 'awaiting_channel_remove')
                 save_data(data)
                 return data
 
@@ -842,7 +2162,8 @@ def process_message(update, data):
             (text or message.get('photo') or message.get('document')) and
             not is_user_command(text)):
             
-            forwarded_messages.add(msg_identifier)
+            with state_lock:
+                forwarded_messages.add(msg_identifier)
             for admin_id in data['admins']:
                 try:
                     forward_message(admin_id, chat_id, message_id)
@@ -856,7 +2177,8 @@ def process_message(update, data):
                                 f"📝: {message_content[:200]}")
                 except Exception:
                     pass
-            send_message(chat_id, "✅ Xabaringiz qabul qilindi! Tez orada javob beramiz.")
+            if flood_control.should_ack(user_id_str, time.time()):
+                send_message(chat_id, "✅ Xabaringiz qabul qilindi! Tez orada javob beramiz.")
 
         save_data(data)
         return data
@@ -866,6 +2188,7 @@ def process_message(update, data):
         return data
 
 def main():
+    global bot_data
     print("🚀 Bot ishga tushmoqda...")
     
     # MongoDB ni ishga tushirish
@@ -881,31 +2204,252 @@ def main():
     # Self-ping ni ishga tushirish
     self_ping()
     
-    # Ma'lumotlarni yuklash
-    data = load_data()
+    # Ma'lumotlarni yuklash (avval snapshotdan)
+    # Qulf ostida - fondagi Mongo qayta ulanishi yarim yuklangan ma'lumotni ko'rmasin
+    with state_lock:
+        data = load_snapshot() or load_data()
+        user_index.rebuild(data['users'])
+        message_index.rebuild(data['messages'])
+        bot_data = data
+    save_json(os.getpid(), BOT_PID_FILE)
     next_offset = load_next_offset()
     
     print(f"✅ Bot ishga tushdi: {format_tashkent_time()}")
     print(f"📊 Userlar: {len(data['users'])}, Kanallar: {len(data['channels'])}")
     
+    if BOT_RUNTIME == 'async':
+        print(f"⚡ Async runtime ({ASYNC_WORKERS} worker)")
+        run_async_polling(data, next_offset)
+    else:
+        run_polling(data, next_offset)
+
+def run_periodic_tasks(data, last_snapshot):
+    """Jamlangan xabarlar, Mongo buferi va snapshot; yangi snapshot vaqtini qaytaradi"""
+    flush_flood_notifications(data)
+    if pending_mongo_users or pending_mongo_channels or mongo_resync:
+        flush_mongo(data)
+    if time.time() - last_snapshot >= SNAPSHOT_INTERVAL:
+        write_snapshot(data)
+        last_snapshot = time.time()
+    return last_snapshot
+
+# Tashqaridan to'xtatish (benchmark, testlar) - ikkala runtime ham tekshiradi
+stop_requested = threading.Event()
+async_stop = None  # (event loop, asyncio.Event)
+
+def request_stop():
+    stop_requested.set()
+    if async_stop is not None:
+        loop, stop = async_stop
+        loop.call_soon_threadsafe(stop.set)
+
+def shutdown(data):
+    print("🛑 Bot to'xtatilmoqda...")
+    save_data(data)
+    write_snapshot(data)
+    try:
+        os.remove(BOT_PID_FILE)
+    except OSError:
+        pass
+
+def run_polling(data, next_offset):
+    global bot_data
+    # SIGTERM (platforma restart) da snapshot yozib chiqish
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    last_snapshot = time.time()
+    
+    # Async runtime qulagan bo'lsa - tasdiqlangan, lekin tugallanmagan update'lar
+    pending = load_inflight_updates()
+    if pending:
+        print(f"♻️ {len(pending)} ta tugallanmagan update qayta ishlanmoqda")
+        for update in pending:
+            data = process_message(update, data)
+            bot_data = data
+            next_offset = max(next_offset or 0, update['update_id'] + 1)
+        save_next_offset(next_offset)
+        save_inflight_updates([])
+    
     # Asosiy loop
-    while True:
+    try:
+        while not stop_requested.is_set():
+            try:
+                # Jamlangan xabarlar bo'lsa - qisqa polling, ular kechikmasin
+                updates = get_updates(next_offset, 5 if flood_control.pending else 60)
+                
+                for update in updates:
+                    update_id = update.get('update_id')
+                    if update_id is not None:
+                        if next_offset is None or update_id >= next_offset:
+                            data = process_message(update, data)
+                            bot_data = data
+                            next_offset = update_id + 1
+                            save_next_offset(next_offset)
+                
+                last_snapshot = run_periodic_tasks(data, last_snapshot)
+                
+                time.sleep(1)
+                
+            except Exception as e:
+                print(f"Xato: {e}")
+                time.sleep(5)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    shutdown(data)
+
+# Async runtime - bitta chat update'lari ketma-ket, turli chatlar parallel
+async def async_get_updates(session, offset, poll_timeout):
+    if telegram_breaker.is_open():
+        await asyncio.sleep(min(telegram_breaker.remaining(), poll_timeout))
+        return []
+    # Sinov paytida long polling yagona sinov o'rnini band qilib turmasin - handlerlar yubora olsin
+    if not telegram_breaker.is_closed():
+        poll_timeout = 0
+    if not telegram_breaker.allow():
+        await asyncio.sleep(1)
+        return []
+    params = {'timeout': poll_timeout, 'limit': 100}
+    if offset is not None:
+        params['offset'] = offset
+    try:
+        response = await aiohttp_request(session, 'getUpdates', params=params, timeout=poll_timeout + 5)
+    except Exception:
+        telegram_breaker.record(False)
+        return []
+    telegram_breaker.record(telegram_status_ok(response.status_code))
+    if response.status_code == 200:
+        return response.json().get('result', [])
+    return []
+
+def run_async_polling(data, next_offset):
+    try:
+        asyncio.run(async_polling(data, next_offset))
+    except KeyboardInterrupt:
+        pass
+
+async def async_polling(data, next_offset):
+    global async_transport, async_stop
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='handler')
+    stop = asyncio.Event()
+    async_stop = (loop, stop)
+    if stop_requested.is_set():
+        stop.set()
+    for sig in (signal.SIGTERM, signal.SIGINT):
         try:
-            updates = get_updates(next_offset)
-            
-            for update in updates:
-                update_id = update.get('update_id')
-                if update_id is not None:
-                    if next_offset is None or update_id >= next_offset:
-                        data = process_message(update, data)
-                        next_offset = update_id + 1
-                        save_next_offset(next_offset)
-            
-            time.sleep(1)
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # main thread emas yoki platforma qo'llamaydi
+
+    chat_queues = {}   # chat_id -> navbatdagi update'lar
+    workers = set()
+    # Telegram olingan update'lar uchun darhol tasdiqlanadi (fetched bilan so'raladi) - sekin chat
+    # boshqalarini to'xtatmaydi. Tugallanmagan update'lar tanasi INFLIGHT_FILE jurnalida turadi va
+    # crash dan keyin qayta ishlanadi; jurnal har doim offset dan oldin yoziladi
+    in_flight = {}   # update_id -> update
+    pending = load_inflight_updates()
+    fetched = committed = next_offset
+    if pending:
+        print(f"♻️ {len(pending)} ta tugallanmagan update qayta ishlanmoqda")
+        fetched = max(fetched or 0, pending[-1]['update_id'] + 1)
+    journal_dirty = bool(pending)
+    journal_timer = None
+    progress = asyncio.Event()
+
+    def commit():
+        nonlocal committed, journal_dirty, journal_timer
+        if journal_timer is not None:
+            journal_timer.cancel()
+            journal_timer = None
+        if journal_dirty:
+            save_inflight_updates(sorted(in_flight.values(), key=lambda u: u['update_id']))
+            journal_dirty = False
+        if fetched is not None and fetched != committed:
+            committed = fetched
+            save_next_offset(fetched)
+
+    def schedule_commit():
+        # Tugagan update'lar jurnaldan soniyasiga ko'pi bilan bir marta o'chiriladi (har biri uchun butun
+        # jurnalni qayta yozmaslik uchun); crash bo'lsa shu oraliqda tugaganlari qayta ishlanishi mumkin
+        nonlocal journal_timer
+        if journal_timer is None:
+            journal_timer = loop.call_later(1, commit)
+
+    async def chat_worker(chat_id):
+        nonlocal journal_dirty
+        queue = chat_queues[chat_id]
+        while queue:
+            try:
+                await loop.run_in_executor(executor, process_message, queue[0], data)
+            except Exception as e:
+                print(f"Xabarni qayta ishlash xatosi: {e}")
+            in_flight.pop(queue.popleft()['update_id'], None)
+            journal_dirty = True
+            schedule_commit()
+            progress.set()
+        del chat_queues[chat_id]
+
+    def dispatch(update):
+        nonlocal journal_dirty
+        in_flight[update['update_id']] = update
+        journal_dirty = True
+        chat_id = (update.get('message') or {}).get('chat', {}).get('id')
+        if chat_id in chat_queues:
+            chat_queues[chat_id].append(update)
+            return
+        chat_queues[chat_id] = deque([update])
+        task = asyncio.create_task(chat_worker(chat_id))
+        workers.add(task)
+        task.add_done_callback(workers.discard)
+
+    last_snapshot = time.time()
+    stop_task = asyncio.create_task(stop.wait())
+    async with aiohttp.ClientSession() as session:
+        async_transport = (loop, session)
+        for update in pending:
+            dispatch(update)
+        commit()
+        try:
+            while not stop.is_set():
+                try:
+                    if len(in_flight) >= ASYNC_MAX_INFLIGHT:
+                        # Navbat to'lgan - biror update tugaguncha yangilarini olmaymiz (xotira chegarasi)
+                        progress.clear()
+                        progress_task = asyncio.create_task(progress.wait())
+                        await asyncio.wait({progress_task, stop_task}, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+                        progress_task.cancel()
+                    else:
+                        poll = asyncio.create_task(async_get_updates(
+                            session, fetched, 5 if flood_control.pending else 60))
+                        await asyncio.wait({poll, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+                        if not poll.done():
+                            poll.cancel()
+                            break
+                        
+                        for update in poll.result():
+                            update_id = update.get('update_id')
+                            if update_id is not None:
+                                if fetched is None or update_id >= fetched:
+                                    dispatch(update)
+                                    fetched = update_id + 1
+                        # Keyingi getUpdates ularni Telegramda tasdiqlaydi - undan oldin jurnalga
+                        commit()
+                    
+                    last_snapshot = await loop.run_in_executor(executor, run_periodic_tasks, data, last_snapshot)
+                    
+                except Exception as e:
+                    print(f"Xato: {e}")
+                    await asyncio.sleep(5)
             
-        except Exception as e:
-            print(f"Xato: {e}")
-            time.sleep(5)
+            # Navbatdagi update'lar tugashini kutish
+            if workers:
+                await asyncio.gather(*workers, return_exceptions=True)
+            commit()
+            await loop.run_in_executor(executor, shutdown, data)
+        finally:
+            async_transport = async_stop = None
+            stop_task.cancel()
+            executor.shutdown(wait=False)
 
 if __name__ == '__main__':
     main()
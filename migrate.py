@@ -0,0 +1,440 @@
+"""JSON fayllar va MongoDB o'rtasida foydalanuvchi/kanallarni ko'chirish va moslashtirish
+
+Foydalanuvchilar oqim bilan (batch'lab) o'qiladi va yoziladi - xotira foydalanuvchilar soniga
+bog'liq emas. Ziddiyatlarda `last_active`, teng bo'lsa `message_count` kattasi g'olib.
+
+Ishga tushirish:
+    python migrate.py json-to-mongo            # data/users.json -> MongoDB
+    python migrate.py mongo-to-json            # MongoDB -> data/users.json
+    python migrate.py reconcile                # ikkala tomonni bir xil holatga keltirish
+    python migrate.py reconcile --dry-run --show-diffs 20
+
+Bot ishlab turgan bo'lsa (data/bot.pid) yozish rad etiladi - bot keyingi save_data da natijani
+xotiradagi holat bilan qayta yozib yuboradi. O'qib bo'lmaydigan yozuvlar o'tkazib yuborilmaydi:
+JSON dagi asl holicha qoldiriladi va hisobotda ko'rsatiladi.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from dotenv import load_dotenv
+import pymongo
+from pymongo import UpdateOne
+
+load_dotenv()
+
+USERS_FILE = 'data/users.json'
+CHANNELS_FILE = 'data/channels.json'
+BOT_PID_FILE = 'bot.pid'  # main.py users.json yonida yozadi
+
+USER_FIELDS = ('first_name', 'last_name', 'username', 'phone', 'joined', 'last_active')
+
+def user_doc(uid, u):
+    """Foydalanuvchi yozuvini main.save_data bilan bir xil Mongo hujjatiga aylantiradi"""
+    doc = {'id': int(uid)}
+    for field in USER_FIELDS:
+        doc[field] = u.get(field, '') or ''
+    doc['message_count'] = int(u.get('message_count', 0) or 0)
+    doc['is_admin'] = bool(u.get('is_admin', False))
+    return doc
+
+def channel_doc(key, c):
+    return {
+        'username': c.get('username', key),
+        'name': c.get('name', key),
+        'added_by': c.get('added_by'),
+        'added_date': c.get('added_date')
+    }
+
+def user_rank(doc):
+    return (doc.get('last_active') or '', doc.get('message_count', 0))
+
+def resolve_user(json_doc, mongo_doc):
+    """(g'olib hujjat, manba) qaytaradi; manba: 'same', 'json' yoki 'mongo'"""
+    if json_doc == mongo_doc:
+        return mongo_doc, 'same'
+    winner, source = (json_doc, 'json') if user_rank(json_doc) > user_rank(mongo_doc) else (mongo_doc, 'mongo')
+    # Qo'shilgan sana - eng birinchisi
+    joined = [d['joined'] for d in (json_doc, mongo_doc) if d.get('joined')]
+    if joined and min(joined) != winner.get('joined'):
+        winner = dict(winner, joined=min(joined))
+    return winner, source
+
+def diff_fields(a, b):
+    return sorted(k for k in set(a) | set(b) if a.get(k) != b.get(k))
+
+# Oqimli JSON o'qish/yozish
+def iter_json_object(path, chunk_size=1 << 16):
+    """Katta JSON obyektidan (kalit, qiymat) juftliklarini to'liq yuklamasdan o'qiydi"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def skip_ws():
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+
+        def expect(char):
+            skip_ws()
+            if pos >= len(buf) or buf[pos] != char:
+                raise ValueError(f"{path}: '{char}' kutilgan edi")
+            return pos + 1
+
+        def decode():
+            nonlocal buf, pos, eof
+            skip_ws()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # Bufer oxirida tugagan qiymat (masalan son) to'liq bo'lmasligi mumkin
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except ValueError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+
+        pos = expect('{')
+        skip_ws()
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        while True:
+            key = decode()
+            pos = expect(':')
+            value = decode()
+            yield key, value
+            skip_ws()
+            if pos < len(buf) and buf[pos] == ',':
+                pos += 1
+                continue
+            pos = expect('}')
+            return
+
+class JsonObjectWriter:
+    """save_json bilan bir xil formatda (indent=2) JSON obyektni qisman yozadi"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.f = open(self.tmp_path, 'w', encoding='utf-8')
+        self.f.write('{')
+        self.count = 0
+
+    def write(self, key, value):
+        body = json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+        self.f.write((',' if self.count else '') + '\n  ' + json.dumps(str(key), ensure_ascii=False) + ': ' + body)
+        self.count += 1
+
+    def commit(self):
+        self.f.write('\n}' if self.count else '}')
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+def iter_json_users(path, report, on_skip=None):
+    """JSON foydalanuvchilari; o'qib bo'lmaydiganlari hisobotga yoziladi va on_skip(uid, asl qiymat) ga beriladi"""
+    if not os.path.exists(path):
+        return
+    for uid, u in iter_json_object(path):
+        try:
+            yield user_doc(uid, u)
+        except (TypeError, ValueError, AttributeError):
+            report.add_skipped('json', uid, u)
+            if on_skip:
+                on_skip(uid, u)
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class Report:
+    def __init__(self, show_diffs=0):
+        self.counts = {
+            'json_records': 0, 'mongo_records': 0, 'only_json': 0, 'only_mongo': 0,
+            'identical': 0, 'json_won': 0, 'mongo_won': 0,
+            'written_mongo': 0, 'written_json': 0, 'channels_written_mongo': 0, 'channels_written_json': 0,
+            'skipped_json': 0, 'skipped_mongo': 0
+        }
+        self.show_diffs = show_diffs
+        self.diffs = []
+        self.skipped = []        # (manba, id) - hisobot uchun birinchi 20 tasi
+        self.skipped_raw = {}    # JSON dagi o'qib bo'lmaydigan yozuvlar: uid -> asl qiymat
+        self.started = time.perf_counter()
+
+    def add(self, key, n=1):
+        self.counts[key] += n
+
+    def add_skipped(self, source, uid, raw=None):
+        self.counts[f'skipped_{source}'] += 1
+        if len(self.skipped) < 20:
+            self.skipped.append({'source': source, 'id': str(uid)})
+        if source == 'json':
+            self.skipped_raw[str(uid)] = raw
+        print(f"⚠️ {source}: {uid} yozuvini o'qib bo'lmadi", file=sys.stderr)
+
+    def add_diff(self, uid, json_doc, mongo_doc, source):
+        if len(self.diffs) < self.show_diffs:
+            self.diffs.append({'id': uid, 'winner': source, 'fields': diff_fields(json_doc or {}, mongo_doc or {})})
+
+    def result(self, mode, dry_run):
+        elapsed = time.perf_counter() - self.started
+        processed = self.counts['json_records'] + self.counts['only_mongo']
+        out = {'mode': mode, 'dry_run': dry_run, 'elapsed_s': round(elapsed, 3),
+               'records_per_s': round(processed / elapsed, 1) if elapsed else None}
+        out.update(self.counts)
+        if self.skipped:
+            out['skipped'] = self.skipped
+        if self.show_diffs:
+            out['diffs'] = self.diffs
+        return out
+
+# Foydalanuvchilar
+def merge_json_batch(batch, users_col, report):
+    """JSON batch ni Mongo dagi mos yozuvlar bilan solishtiradi: (json, g'olib, mongo) ro'yxati"""
+    ids = [doc['id'] for doc in batch]
+    existing = {}
+    for doc in users_col.find({'id': {'$in': ids}}, {'_id': 0}):
+        try:
+            existing[doc['id']] = user_doc(doc['id'], doc)
+        except (TypeError, ValueError, AttributeError):
+            # Buzilgan Mongo yozuvi - JSON dagisi bilan almashtiriladi
+            report.add_skipped('mongo', doc['id'])
+
+    merged = []
+    for json_doc in batch:
+        report.add('json_records')
+        mongo_doc = existing.get(json_doc['id'])
+        if mongo_doc is None:
+            report.add('only_json')
+            report.add_diff(json_doc['id'], json_doc, None, 'json')
+            merged.append((json_doc, json_doc, None))
+            continue
+        winner, source = resolve_user(json_doc, mongo_doc)
+        report.add({'same': 'identical', 'json': 'json_won', 'mongo': 'mongo_won'}[source])
+        if source != 'same':
+            report.add_diff(json_doc['id'], json_doc, mongo_doc, source)
+        merged.append((json_doc, winner, mongo_doc))
+    return merged
+
+def json_to_mongo(db, users_file, batch_size, dry_run, report):
+    """JSON dagi yangiroq yozuvlarni Mongo ga yozadi (faqat Mongo dagi yozuvlarga tegilmaydi)"""
+    users_col = db['users']
+    mongo_before = users_col.count_documents({})
+    for batch in batched(iter_json_users(users_file, report), batch_size):
+        ops = [UpdateOne({'id': winner['id']}, {'$set': winner}, upsert=True)
+               for _, winner, mongo_doc in merge_json_batch(batch, users_col, report) if winner != mongo_doc]
+        if ops and not dry_run:
+            users_col.bulk_write(ops, ordered=False)
+        report.add('written_mongo', len(ops))
+    report.counts['mongo_records'] = mongo_before
+    report.counts['only_mongo'] = mongo_before - (report.counts['json_records'] - report.counts['only_json'])
+
+def mongo_to_json(db, users_file, batch_size, dry_run, report):
+    """Mongo dagi yangiroq yozuvlarni JSON ga yozadi (faqat JSON dagi yozuvlar saqlanadi)"""
+    users_col = db['users']
+    if dry_run:
+        # Dry-run hech narsa yozmaydi (vaqtinchalik kolleksiya ham) - faqat Mongo dagilar sonidan olinadi
+        mongo_before = users_col.count_documents({})
+        for batch in batched(iter_json_users(users_file, report), batch_size):
+            for json_doc, winner, _ in merge_json_batch(batch, users_col, report):
+                if winner != json_doc:
+                    report.add('written_json')
+        only_mongo = mongo_before - (report.counts['json_records'] - report.counts['only_json'])
+        report.counts['mongo_records'] = mongo_before
+        report.counts['only_mongo'] = only_mongo
+        report.add('written_json', only_mongo)
+        return
+
+    seen_col = db[f"_migrate_seen_{os.getpid()}"]
+    seen_col.create_index('id')
+    writer = JsonObjectWriter(users_file)
+
+    def keep_raw(uid, raw):
+        # O'qib bo'lmaydigan yozuv asl holicha qoladi; Mongo dagi shu ID u bilan almashtirilmaydi
+        writer.write(uid, raw)
+        if str(uid).lstrip('-').isdigit():
+            seen_col.insert_one({'id': int(uid)})
+
+    try:
+        for batch in batched(iter_json_users(users_file, report, keep_raw), batch_size):
+            seen_col.insert_many([{'id': doc['id']} for doc in batch], ordered=False)
+            for json_doc, winner, _ in merge_json_batch(batch, users_col, report):
+                writer.write(winner['id'], winner)
+                if winner != json_doc:
+                    report.add('written_json')
+
+        # Faqat Mongo da bor yozuvlar - anti-join server tomonda bajariladi
+        pipeline = [
+            {'$match': {'id': {'$ne': None}}},
+            {'$lookup': {'from': seen_col.name, 'localField': 'id', 'foreignField': 'id', 'as': 'seen'}},
+            {'$match': {'seen': {'$size': 0}}},
+            {'$project': {'_id': 0, 'seen': 0}},
+        ]
+        for doc in users_col.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+            try:
+                doc = user_doc(doc['id'], doc)
+            except (TypeError, ValueError, AttributeError):
+                report.add_skipped('mongo', doc['id'])
+                continue
+            report.add('only_mongo')
+            report.add('written_json')
+            report.add_diff(doc['id'], None, doc, 'mongo')
+            writer.write(doc['id'], doc)
+        writer.commit()
+        writer = None
+    finally:
+        if writer:
+            writer.abort()
+        seen_col.drop()
+    report.counts['mongo_records'] = users_col.count_documents({})
+
+def dump_mongo_to_json(db, users_file, batch_size, report):
+    """Mongo dagi barcha foydalanuvchilarni JSON ga to'liq yozadi (JSON dagi o'qilmagan yozuvlar saqlanadi)"""
+    writer = JsonObjectWriter(users_file)
+    try:
+        for doc in users_col_iter(db['users'], batch_size, report):
+            if str(doc['id']) not in report.skipped_raw:
+                writer.write(doc['id'], doc)
+        for uid, raw in report.skipped_raw.items():
+            writer.write(uid, raw)
+        writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+    report.counts['written_json'] = writer.count
+
+def users_col_iter(users_col, batch_size, report):
+    for doc in users_col.find({'id': {'$ne': None}}, {'_id': 0}).sort('id', 1).batch_size(batch_size):
+        try:
+            yield user_doc(doc['id'], doc)
+        except (TypeError, ValueError, AttributeError):
+            report.add_skipped('mongo', doc['id'])
+
+# Kanallar (soni kam - to'liq xotirada)
+def sync_channels(db, channels_file, mode, dry_run, report):
+    channels_col = db['channels']
+    json_channels = {}
+    if os.path.exists(channels_file):
+        with open(channels_file, 'r', encoding='utf-8') as f:
+            json_channels = {key: channel_doc(key, c) for key, c in json.load(f).items()}
+    mongo_channels = {}
+    for doc in channels_col.find({}, {'_id': 0}):
+        key = doc.get('username')
+        if key:
+            mongo_channels[key] = channel_doc(key, doc)
+
+    merged = {}
+    for key in set(json_channels) | set(mongo_channels):
+        j, m = json_channels.get(key), mongo_channels.get(key)
+        if j is None or m is None:
+            merged[key] = j or m
+        else:
+            merged[key] = j if (j.get('added_date') or '') > (m.get('added_date') or '') else m
+
+    if mode in ('json-to-mongo', 'reconcile'):
+        ops = [UpdateOne({'username': c['username']}, {'$set': c}, upsert=True)
+               for key, c in merged.items() if mongo_channels.get(key) != c]
+        if ops and not dry_run:
+            channels_col.bulk_write(ops, ordered=False)
+        report.add('channels_written_mongo', len(ops))
+    if mode in ('mongo-to-json', 'reconcile') and merged != json_channels:
+        if not dry_run:
+            tmp_path = channels_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(merged, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, channels_file)
+        report.add('channels_written_json', sum(1 for k, c in merged.items() if json_channels.get(k) != c))
+
+def running_bot_pid(users_file):
+    """users.json dan foydalanayotgan bot jarayonining PID i (ishlamayotgan bo'lsa None)"""
+    try:
+        with open(os.path.join(os.path.dirname(users_file) or '.', BOT_PID_FILE), 'r') as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    if pid == os.getpid():
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass  # boshqa foydalanuvchining jarayoni - lekin ishlab turibdi
+    return pid
+
+def main():
+    parser = argparse.ArgumentParser(description="codermrxbot JSON <-> MongoDB migratsiya")
+    parser.add_argument('mode', choices=['json-to-mongo', 'mongo-to-json', 'reconcile'])
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--mongo-db', default=os.getenv('MONGO_DB', 'codermrxbot'))
+    parser.add_argument('--users-file', default=USERS_FILE)
+    parser.add_argument('--channels-file', default=CHANNELS_FILE)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help="hech narsa yozmasdan farqlarni ko'rsatish")
+    parser.add_argument('--show-diffs', type=int, default=0, help="farq qilgan birinchi N yozuvni ko'rsatish")
+    parser.add_argument('--force', action='store_true', help="bot ishlab turgan bo'lsa ham yozish")
+    args = parser.parse_args()
+
+    pid = running_bot_pid(args.users_file)
+    if pid and not args.dry_run:
+        if not args.force:
+            print(f"❌ Bot ishlab turibdi (PID {pid}): natija botning keyingi saqlashida qayta yozib yuboriladi. "
+                  "Botni to'xtating, --dry-run yoki --force ishlating")
+            sys.exit(1)
+        print(f"⚠️ Bot ishlab turibdi (PID {pid}), --force bilan davom etilmoqda", file=sys.stderr)
+
+    try:
+        client = pymongo.MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)
+        client.admin.command('ping')
+    except Exception as e:
+        print(f"❌ MongoDB ga ulanmadi: {e}")
+        sys.exit(1)
+    db = client[args.mongo_db]
+    db['users'].create_index('id')
+    db['channels'].create_index('username')
+
+    report = Report(args.show_diffs)
+    if args.mode == 'json-to-mongo':
+        json_to_mongo(db, args.users_file, args.batch_size, args.dry_run, report)
+    elif args.mode == 'mongo-to-json':
+        mongo_to_json(db, args.users_file, args.batch_size, args.dry_run, report)
+    else:
+        # Avval Mongo ikkala manbaning birlashmasiga keltiriladi, keyin JSON undan qayta yoziladi
+        json_to_mongo(db, args.users_file, args.batch_size, args.dry_run, report)
+        if not args.dry_run:
+            dump_mongo_to_json(db, args.users_file, args.batch_size, report)
+        else:
+            report.counts['written_json'] = report.counts['mongo_won'] + report.counts['only_mongo']
+    sync_channels(db, args.channels_file, args.mode, args.dry_run, report)
+
+    print(json.dumps(report.result(args.mode, args.dry_run), indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
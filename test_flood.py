@@ -0,0 +1,68 @@
+# FloodControl
+def test_flood_control_burst_then_refill(bot):
+    flood = bot.FloodControl(rate=1, burst=3, window=10)
+    assert [flood.allow('u', 0) for _ in range(4)] == [True, True, True, False]
+    assert not flood.allow('u', 0.5)
+    assert flood.allow('u', 1.5)
+
+def test_flood_control_users_are_independent(bot):
+    flood = bot.FloodControl(rate=1, burst=1, window=10)
+    assert flood.allow('a', 0)
+    assert not flood.allow('a', 0)
+    assert flood.allow('b', 0)
+
+def test_flood_control_coalesces_until_window_passes(bot):
+    flood = bot.FloodControl(rate=1, burst=1, window=10)
+    assert flood.throttle('u', 5, 'bir', 0)
+    assert not flood.throttle('u', 5, 'ikki', 4)
+    assert flood.due(13) == []
+    ready = flood.due(14)
+    assert [uid for uid, _ in ready] == ['u']
+    assert ready[0][1]['count'] == 2
+    assert ready[0][1]['texts'] == ['bir', 'ikki']
+    assert not flood.pending
+
+def test_flood_control_keeps_media_up_to_limit(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'FLOOD_MEDIA_MAX', 2)
+    flood = bot.FloodControl(rate=1, burst=1, window=10)
+    for message_id in (7, 8, 9):
+        flood.throttle('u', 5, '📎 Fayl/Rasm', 0, message_id)
+    entry = flood.pending['u']
+    assert entry['media'] == [7, 8]
+    assert entry['media_dropped'] == 1
+
+def test_flood_control_ack_once_per_window(bot):
+    flood = bot.FloodControl(rate=1, burst=1, window=10)
+    assert flood.should_ack('u', 100)
+    assert not flood.should_ack('u', 105)
+    assert flood.should_ack('u', 111)
+
+def test_flood_control_due_drops_idle_buckets(bot):
+    flood = bot.FloodControl(rate=1, burst=2, window=10)
+    flood.allow('u', 0)
+    flood.should_ack('u', 0)
+    flood.due(1)
+    assert 'u' in flood.buckets
+    flood.due(3)
+    assert 'u' not in flood.buckets
+    assert 'u' not in flood.last_ack
+
+def test_flood_summary_escapes_user_names(bot, monkeypatch):
+    flood = bot.FloodControl(rate=1, burst=1, window=10)
+    flood.throttle('10', 10, 'a < b', 0, 7)
+    monkeypatch.setattr(bot, 'flood_control', flood)
+    monkeypatch.setattr(bot.time, 'time', lambda: 100)
+    sent, forwarded = [], []
+    monkeypatch.setattr(bot, 'send_message', lambda chat_id, text, reply_markup=None: sent.append((chat_id, text)))
+    monkeypatch.setattr(bot, 'forward_message', lambda *args: forwarded.append(args))
+    monkeypatch.setattr(bot, 'save_data', lambda data: None)
+    data = {'users': {'10': {'id': 10, 'first_name': '<b>Ali', 'last_name': 'A&B', 'username': 'ali<'}},
+            'channels': {}, 'admins': [1], 'messages': []}
+
+    bot.flush_flood_notifications(data)
+    (chat_id, text), = sent
+    assert chat_id == 1
+    assert "👤: &lt;b&gt;Ali A&amp;B" in text
+    assert "📱: @ali&lt;" in text
+    assert "• a &lt; b" in text
+    assert forwarded == [(1, 10, 7)]
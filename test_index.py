@@ -0,0 +1,155 @@
+from datetime import datetime
+
+import pytest
+
+NOW = '2024-06-15 12:00:00'
+
+def make_user(uid, joined, last_active, username='', first_name='', last_name=''):
+    return {'id': uid, 'first_name': first_name or f"User{uid}", 'last_name': last_name, 'username': username,
+            'joined': joined, 'last_active': last_active, 'message_count': 1}
+
+@pytest.fixture
+def segments(bot, monkeypatch):
+    """Vaqt 2024-06-15 12:00 ga qotirilgan, toza user_index bilan"""
+    now = datetime.strptime(NOW, '%Y-%m-%d %H:%M:%S').replace(tzinfo=bot.TASHKENT_TZ)
+    monkeypatch.setattr(bot, 'get_tashkent_time', lambda: now)
+    monkeypatch.setattr(bot, 'user_index', bot.UserIndex())
+    users = {
+        '10': make_user(10, '2024-01-01 00:00:00', '2024-06-08 11:59:59'),   # chegara kunida, oldin
+        '11': make_user(11, '2024-05-31 23:59:59', '2024-06-08 12:00:00'),   # aynan chegarada
+        '12': make_user(12, '2024-06-01 00:00:00', '2024-06-15 09:00:00', username='ali'),
+        '13': make_user(13, '2024-06-10 00:00:00', '2024-06-01 00:00:00'),
+        '1': make_user(1, '2024-06-02 00:00:00', '2024-06-15 10:00:00', username='admin'),
+    }
+    bot.user_index.rebuild(users)
+    return {'users': users, 'channels': {}, 'admins': [1], 'messages': []}
+
+# UserIndex / resolve_segment
+def test_active_since_checks_time_on_cutoff_day(bot, segments):
+    cutoff = '2024-06-08 12:00:00'
+    assert bot.user_index.active_since(cutoff, segments['users']) == {'11', '12', '1'}
+
+def test_active_segment_matches_stats_window(bot, segments):
+    assert sorted(bot.resolve_segment('active_7d', segments)) == ['11', '12']
+    # get_stats ham xuddi shu 7 kunlik oynani sanaydi (admin ham foydalanuvchi sifatida)
+    assert "Faol foydalanuvchilar:</b> 3" in bot.get_stats(segments)
+
+def test_joined_since_month_start(bot, segments):
+    assert bot.user_index.joined_since('2024-06-01') == {'12', '13', '1'}
+    assert sorted(bot.resolve_segment('joined_month', segments)) == ['12', '13']
+
+def test_segments_exclude_admins_and_follow_index_updates(bot, segments):
+    assert bot.resolve_segment('has_username', segments) == ['12']
+    segments['users']['13']['last_active'] = '2024-06-15 11:00:00'
+    bot.user_index.update('13', segments['users']['13'])
+    assert sorted(bot.resolve_segment('active_7d', segments)) == ['11', '12', '13']
+    assert sorted(bot.resolve_segment('all', segments)) == ['10', '11', '12', '13']
+
+# Foydalanuvchi qidiruvi
+@pytest.fixture
+def people(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'user_index', bot.UserIndex())
+    users = {
+        '20': make_user(20, NOW, NOW, username='AliValiyev', first_name='Ali', last_name='Valiyev'),
+        '21': make_user(21, NOW, NOW, username='alisher', first_name='Alisher', last_name='Karimov'),
+        '22': make_user(22, NOW, NOW, first_name='Vali', last_name='Aliyev'),
+    }
+    bot.user_index.rebuild(users)
+    return {'users': users, 'channels': {}, 'admins': [1], 'messages': []}
+
+def test_user_search_username_and_token_prefix(bot, people):
+    # Username tartibida: alisher < alivaliyev (katta-kichik harf farqsiz)
+    assert bot.user_index.search('@ali') == ['21', '20']
+    assert bot.user_index.search('@') == []
+    # Bitta so'z - ism tokeni yoki username prefiksi
+    assert bot.user_index.search('ali') == ['20', '21', '22']
+    # Bir necha so'z - har bir token prefiksi kesishmasi
+    assert bot.user_index.search('ali val') == ['20', '22']   # Ali Valiyev, Vali Aliyev
+    assert bot.user_index.search('ali kar') == ['21']
+    assert bot.user_index.search('21') == ['21']
+
+def test_user_search_follows_profile_change(bot, people):
+    user = people['users']['21']
+    user.update(username='shera', first_name='Sher', last_name='Karimov')
+    bot.user_index.update('21', user)
+    assert bot.user_index.search('@ali') == ['20']
+    assert bot.user_index.search('@she') == ['21']
+    assert '21' not in bot.user_index.search('alisher')
+    assert bot.user_index.search('sher kar') == ['21']
+    # Eski token boshqa userda yo'q bo'lsa saralangan ro'yxatdan ham olib tashlanadi
+    assert 'alisher' not in bot.user_index.sorted_tokens
+    assert ('alisher', '21') not in bot.user_index.usernames
+
+def test_format_user_search_escapes_and_limits(bot, people, monkeypatch):
+    monkeypatch.setattr(bot, 'USER_SEARCH_LIMIT', 1)
+    people['users']['22']['first_name'] = '<b>Vali</b>'
+    text = bot.format_user_search('ali', people)
+    assert text.startswith("🔎 <b>Topildi:</b> 3")
+    assert "... va yana 2 ta" in text
+    assert bot.format_user_search('@yoq', people) == "🔎 Hech kim topilmadi"
+    text = bot.format_user_search('22', people)
+    assert "&lt;b&gt;Vali&lt;/b&gt;" in text
+
+# Xabarlar qidiruvi
+def make_messages(count, users=('30', '31'), per_day=4):
+    messages = []
+    for i in range(count):
+        day, hour = divmod(i, per_day)
+        words = ['narx'] + (['yetkazish'] if i % 3 == 0 else []) + [f"n{i}"]
+        messages.append({'user_id': int(users[i % len(users)]), 'text': ' '.join(words),
+                         'date': f"2024-06-{day + 1:02d} {hour * 6:02d}:00:00"})
+    return messages
+
+@pytest.fixture
+def inbox(bot, monkeypatch):
+    messages = make_messages(40)
+    monkeypatch.setattr(bot, 'message_index', bot.MessageIndex())
+    monkeypatch.setattr(bot, 'user_index', bot.UserIndex())
+    users = {'30': make_user(30, NOW, NOW, username='sotuvchi'), '31': make_user(31, NOW, NOW)}
+    bot.user_index.rebuild(users)
+    bot.message_index.rebuild(messages)
+    return {'users': users, 'channels': {}, 'admins': [1], 'messages': messages}
+
+def test_message_search_date_range_bisect(bot, inbox):
+    messages = inbox['messages']
+    seqs = bot.message_index.search(messages, date_from='2024-06-03', date_to='2024-06-04 23:59:59')
+    assert seqs == list(range(8, 16))
+    # Chegaralar aniq vaqt bo'yicha: 06-03 06:00 dan 06-03 12:00 gacha
+    assert bot.message_index.search(messages, date_from='2024-06-03 06:00:00',
+                                    date_to='2024-06-03 12:00:00') == [9, 10]
+    assert bot.message_index.search(messages, date_from='2025-01-01') == []
+
+def test_message_search_intersects_tokens_user_and_dates(bot, inbox):
+    messages = inbox['messages']
+    assert bot.message_index.search(messages, ['narx', 'yetkazish']) == list(range(0, 40, 3))
+    assert bot.message_index.search(messages, ['narx', 'yetkazish'], user_id='30') == [0, 6, 12, 18, 24, 30, 36]
+    assert bot.message_index.search(messages, ['yetkazish'], user_id=31,
+                                    date_from='2024-06-02', date_to='2024-06-05 23:59:59') == [9, 15]
+    assert bot.message_index.search(messages, ['narx', 'yoq']) == []
+
+def test_message_search_pagination_bounds(bot, inbox, monkeypatch):
+    monkeypatch.setattr(bot, 'MESSAGE_SEARCH_PAGE', 15)
+    text, has_next = bot.format_message_search('narx', 1, inbox)
+    assert "sahifa 1/3" in text and has_next
+    # Yangilari birinchi: 1-sahifa 39..25
+    assert text.index("n39") < text.index("n25") and "n24" not in text
+    text, has_next = bot.format_message_search('narx', 3, inbox)
+    assert "sahifa 3/3" in text and not has_next
+    assert text.endswith("narx yetkazish n0") and "n10" not in text
+    # Chegaradan tashqari sahifalar oxirgi/birinchiga qisiladi
+    assert bot.format_message_search('narx', 99, inbox)[0] == text
+    assert "sahifa 1/3" in bot.format_message_search('narx', 0, inbox)[0]
+
+def test_format_message_search_user_filter_and_empty(bot, inbox):
+    text, has_next = bot.format_message_search('yetkazish user:@sotuv', 1, inbox)
+    assert "Topildi:</b> 7" in text and not has_next
+    assert bot.format_message_search('yoq', 1, inbox) == ("🔍 Xabar topilmadi", False)
+    assert bot.format_message_search('  ', 1, inbox)[0].startswith("❌")
+
+def test_message_index_add_keeps_search_in_sync(bot, inbox):
+    messages = inbox['messages']
+    messages.append({'user_id': 31, 'text': 'Yetkazish <tez>', 'date': '2024-06-11 00:00:00'})
+    bot.message_index.add(len(messages) - 1, messages[-1])
+    assert bot.message_index.search(messages, ['yetkazish'], date_from='2024-06-10 18:00:00') == [39, 40]
+    text, _ = bot.format_message_search('tez', 1, inbox)
+    assert "&lt;tez&gt;" in text
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+
+import migrate
+
+def write_users(path, users):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(users, f, indent=2, ensure_ascii=False)
+
+def read_users(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def user(uid, last_active, message_count, joined='2024-01-01 00:00:00', **extra):
+    return dict({'id': uid, 'first_name': f"User{uid}", 'last_name': '', 'username': '', 'phone': '',
+                 'joined': joined, 'last_active': last_active, 'message_count': message_count,
+                 'is_admin': False}, **extra)
+
+@pytest.fixture
+def users_file(tmp_path):
+    return str(tmp_path / 'users.json')
+
+def test_resolve_user_newer_wins_and_keeps_first_join():
+    json_doc = migrate.user_doc(1, user(1, '2024-05-01 10:00:00', 3, joined='2024-02-01 00:00:00'))
+    mongo_doc = migrate.user_doc(1, user(1, '2024-04-01 10:00:00', 9, joined='2024-01-01 00:00:00'))
+    winner, source = migrate.resolve_user(json_doc, mongo_doc)
+    assert source == 'json'
+    assert winner['last_active'] == '2024-05-01 10:00:00'
+    assert winner['joined'] == '2024-01-01 00:00:00'
+
+def test_resolve_user_tie_broken_by_message_count():
+    json_doc = migrate.user_doc(1, user(1, '2024-05-01 10:00:00', 3))
+    mongo_doc = migrate.user_doc(1, user(1, '2024-05-01 10:00:00', 7))
+    assert migrate.resolve_user(json_doc, mongo_doc) == (mongo_doc, 'mongo')
+
+def test_iter_json_object_streams_small_chunks(users_file):
+    users = {str(i): user(i, '2024-01-01 00:00:00', i) for i in range(50)}
+    write_users(users_file, users)
+    assert dict(migrate.iter_json_object(users_file, chunk_size=7)) == users
+
+def test_json_to_mongo_merges(fake_db, users_file):
+    col = fake_db['users']
+    col.insert_many([
+        migrate.user_doc(1, user(1, '2024-01-01 00:00:00', 1)),    # JSON yangiroq
+        migrate.user_doc(2, user(2, '2024-09-01 00:00:00', 50)),   # Mongo yangiroq
+        migrate.user_doc(3, user(3, '2024-03-01 00:00:00', 5)),    # faqat Mongo
+    ])
+    write_users(users_file, {
+        '1': user(1, '2024-06-01 00:00:00', 10),
+        '2': user(2, '2024-02-01 00:00:00', 2),
+        '4': user(4, '2024-06-01 00:00:00', 1),
+    })
+    report = migrate.Report()
+    migrate.json_to_mongo(fake_db, users_file, 2, False, report)
+
+    by_id = {d['id']: d for d in col.find({})}
+    assert by_id[1]['message_count'] == 10
+    assert by_id[2]['message_count'] == 50
+    assert by_id[3]['message_count'] == 5
+    assert by_id[4]['last_active'] == '2024-06-01 00:00:00'
+    assert report.counts['json_won'] == 1
+    assert report.counts['mongo_won'] == 1
+    assert report.counts['only_json'] == 1
+    assert report.counts['only_mongo'] == 1
+    assert report.counts['written_mongo'] == 2
+
+def test_json_to_mongo_dry_run_writes_nothing(fake_db, users_file):
+    write_users(users_file, {'1': user(1, '2024-06-01 00:00:00', 1)})
+    report = migrate.Report()
+    migrate.json_to_mongo(fake_db, users_file, 10, True, report)
+    assert fake_db['users'].count_documents({}) == 0
+    assert report.counts['written_mongo'] == 1
+
+def test_mongo_to_json_anti_join_and_skipped_records(fake_db, users_file):
+    fake_db['users'].insert_many([
+        migrate.user_doc(1, user(1, '2024-09-01 00:00:00', 20)),
+        migrate.user_doc(3, user(3, '2024-03-01 00:00:00', 5)),
+        migrate.user_doc(5, user(5, '2024-03-01 00:00:00', 1)),
+    ])
+    broken = {'first_name': 'Buzuq', 'message_count': 'ko\'p'}
+    write_users(users_file, {
+        '1': user(1, '2024-01-01 00:00:00', 1),
+        '2': user(2, '2024-01-01 00:00:00', 1),
+        '5': broken,
+    })
+    report = migrate.Report()
+    migrate.mongo_to_json(fake_db, users_file, 1, False, report)
+
+    users = read_users(users_file)
+    assert set(users) == {'1', '2', '3', '5'}
+    assert users['1']['message_count'] == 20
+    assert users['3']['message_count'] == 5
+    # O'qib bo'lmaydigan yozuv o'zgarishsiz qoladi, Mongo dagi 5 u bilan almashtirilmaydi
+    assert users['5'] == broken
+    assert report.counts['skipped_json'] == 1
+    assert report.counts['only_mongo'] == 1
+    assert report.result('mongo-to-json', False)['skipped'] == [{'source': 'json', 'id': '5'}]
+    assert not any(name.startswith('_migrate_seen_') for name in fake_db.collections)
+
+def test_mongo_to_json_dry_run_touches_nothing(fake_db, users_file):
+    fake_db['users'].insert_many([
+        migrate.user_doc(1, user(1, '2024-09-01 00:00:00', 20)),
+        migrate.user_doc(3, user(3, '2024-03-01 00:00:00', 5)),
+    ])
+    users = {'1': user(1, '2024-01-01 00:00:00', 1), '2': user(2, '2024-01-01 00:00:00', 1)}
+    write_users(users_file, users)
+    report = migrate.Report()
+    migrate.mongo_to_json(fake_db, users_file, 1, True, report)
+
+    assert read_users(users_file) == users
+    # Vaqtinchalik _migrate_seen_* kolleksiyasi ham yaratilmaydi
+    assert fake_db.created == ['users']
+    assert report.counts['mongo_won'] == 1
+    assert report.counts['only_mongo'] == 1
+    assert report.counts['written_json'] == 2
+
+def test_reconcile_dump_keeps_skipped_json(fake_db, users_file):
+    broken = {'message_count': 'x'}
+    write_users(users_file, {'1': user(1, '2024-06-01 00:00:00', 4), 'abc': broken})
+    fake_db['users'].insert_one(migrate.user_doc(2, user(2, '2024-06-01 00:00:00', 1)))
+    report = migrate.Report()
+    migrate.json_to_mongo(fake_db, users_file, 10, False, report)
+    migrate.dump_mongo_to_json(fake_db, users_file, 10, report)
+
+    users = read_users(users_file)
+    assert set(users) == {'1', '2', 'abc'}
+    assert users['abc'] == broken
+
+def test_running_bot_pid(tmp_path):
+    users_file = str(tmp_path / 'users.json')
+    assert migrate.running_bot_pid(users_file) is None
+    (tmp_path / migrate.BOT_PID_FILE).write_text(str(os.getppid()))
+    assert migrate.running_bot_pid(users_file) == os.getppid()
+    (tmp_path / migrate.BOT_PID_FILE).write_text('999999999')
+    assert migrate.running_bot_pid(users_file) is None
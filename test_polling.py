@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import pytest
+
+def make_update(update_id, chat_id):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'chat': {'id': chat_id},
+                                                'from': {'id': chat_id}, 'text': f"xabar {update_id}"}}
+
+@pytest.fixture
+def runtime(bot, monkeypatch):
+    """async_polling tashqi ta'sirlarsiz: qayta ishlangan update'lar processed ga yoziladi"""
+    monkeypatch.setattr(bot, 'stop_requested', threading.Event())
+    monkeypatch.setattr(bot, 'run_periodic_tasks', lambda data, last_snapshot: last_snapshot)
+    monkeypatch.setattr(bot, 'shutdown', lambda data: None)
+    processed = []
+    def process_message(update, data):
+        processed.append(update['update_id'])
+        return data
+    monkeypatch.setattr(bot, 'process_message', process_message)
+    return processed
+
+def run(bot, next_offset=None):
+    bot.run_async_polling({'users': {}, 'channels': {}, 'admins': [1], 'messages': []}, next_offset)
+
+def test_slow_chat_does_not_stall_other_chats(bot, runtime, monkeypatch):
+    release = threading.Event()
+    def process_message(update, data):
+        if update['message']['chat']['id'] == 10:
+            release.wait(10)   # sekin handler
+        runtime.append(update['update_id'])
+        return data
+    monkeypatch.setattr(bot, 'process_message', process_message)
+
+    offsets = []
+    batches = [[make_update(1, 10), make_update(2, 20)], [make_update(3, 20)]]
+    async def get_updates(session, offset, poll_timeout):
+        offsets.append(offset)
+        if batches:
+            return batches.pop(0)
+        # 1-chat hali band, 20-chatning ikkala update'i ham tugashi kerak
+        for _ in range(200):
+            if 3 in runtime:
+                break
+            await asyncio.sleep(0.01)
+        if len(offsets) == 4:
+            # Tasdiqlangan, lekin tugallanmagan update jurnalda
+            assert [u['update_id'] for u in bot.load_inflight_updates()] == [1]
+            release.set()
+            bot.request_stop()
+        return []
+    monkeypatch.setattr(bot, 'async_get_updates', get_updates)
+
+    run(bot)
+    assert runtime.index(3) < runtime.index(1)
+    # Telegram olingan update'lar uchun darhol tasdiqlandi - eng eski tugallanmagan update'dan emas
+    assert offsets == [None, 3, 4, 4]
+    assert bot.load_next_offset() == 4
+    assert bot.load_inflight_updates() == []
+
+def test_inflight_journal_replayed_at_startup(bot, runtime, monkeypatch):
+    bot.save_inflight_updates([make_update(6, 20), make_update(5, 10)])
+    bot.save_next_offset(5)
+    offsets = []
+    async def get_updates(session, offset, poll_timeout):
+        offsets.append(offset)
+        bot.request_stop()
+        return [make_update(7, 10)]
+    monkeypatch.setattr(bot, 'async_get_updates', get_updates)
+
+    run(bot, bot.load_next_offset())
+    assert sorted(runtime) == [5, 6, 7]
+    # Jurnaldagilar Telegramga allaqachon tasdiqlangan - keyingisidan so'raladi
+    assert offsets == [7]
+    assert bot.load_next_offset() == 8
+    assert bot.load_inflight_updates() == []
+
+def test_sync_runtime_replays_inflight_journal(bot, runtime, monkeypatch):
+    bot.save_inflight_updates([make_update(5, 10)])
+    offsets = []
+    def get_updates(offset=None, poll_timeout=60):
+        offsets.append(offset)
+        bot.request_stop()
+        return []
+    monkeypatch.setattr(bot, 'get_updates', get_updates)
+    monkeypatch.setattr(bot.time, 'sleep', lambda seconds: None)
+
+    bot.run_polling({'users': {}, 'channels': {}, 'admins': [1], 'messages': []}, 3)
+    assert runtime == [5]
+    assert offsets == [6]
+    assert bot.load_inflight_updates() == []
@@ -0,0 +1,339 @@
+import pymongo
+import pytest
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(bot, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bot.time, 'time', clock)
+    # Jitter o'rniga to'liq kechikish - vaqtlar aniq bo'lsin
+    monkeypatch.setattr(bot.random, 'uniform', lambda low, high: high)
+    return clock
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+def make_breaker(bot, **kwargs):
+    options = dict(window=60, min_calls=4, failure_ratio=0.5, base_delay=2, max_delay=10)
+    options.update(kwargs)
+    return bot.CircuitBreaker('test', **options)
+
+# CircuitBreaker
+def test_breaker_stays_closed_below_min_calls(bot, clock):
+    breaker = make_breaker(bot)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == 'closed'
+
+def test_breaker_opens_on_failure_ratio(bot, clock):
+    breaker = make_breaker(bot)
+    for ok in (True, True, False, False):
+        breaker.record(ok)
+    assert breaker.state == 'open'
+    assert breaker.is_open()
+    assert breaker.remaining() == 2
+    assert not breaker.allow()
+    assert breaker.stats == {'opened': 1, 'rejected': 1}
+
+def test_breaker_window_forgets_old_failures(bot, clock):
+    breaker = make_breaker(bot)
+    breaker.record(False)
+    breaker.record(False)
+    clock.now += 61
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.state == 'closed'
+
+def test_breaker_half_open_allows_single_probe_and_closes(bot, clock):
+    breaker = make_breaker(bot)
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 2
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()   # sinov davom etmoqda
+    breaker.record(True)
+    assert breaker.state == 'closed'
+    assert breaker.open_count == 0
+    assert breaker.allow()
+
+def test_breaker_failed_probe_reopens_with_backoff(bot, clock):
+    breaker = make_breaker(bot)
+    for _ in range(4):
+        breaker.record(False)
+    delays = []
+    for _ in range(4):
+        delays.append(breaker.remaining())
+        clock.now = breaker.open_until
+        assert breaker.allow()
+        breaker.record(False)
+        assert breaker.state == 'open'
+    assert delays == [2, 4, 8, 10]
+    assert breaker.stats['opened'] == 5
+
+def test_breaker_ignores_results_while_open(bot, clock):
+    breaker = make_breaker(bot)
+    for _ in range(4):
+        breaker.record(False)
+    until = breaker.open_until
+    breaker.record(True)
+    assert breaker.state == 'open'
+    assert breaker.open_until == until
+
+def test_breaker_wait_ready_waits_for_probe_result(bot, clock, monkeypatch):
+    breaker = make_breaker(bot)
+    for _ in range(4):
+        breaker.record(False)
+
+    def sleep(seconds):
+        clock.now += seconds
+        if breaker.probing:
+            breaker.record(True)   # boshqa thread dagi sinov tugadi
+    monkeypatch.setattr(bot.time, 'sleep', sleep)
+
+    assert breaker.wait_ready() == 2
+    assert breaker.allow()
+    assert breaker.wait_ready() == pytest.approx(0.1)
+    assert breaker.is_closed()
+
+def test_broadcast_waits_while_probe_in_flight(bot, clock, monkeypatch):
+    monkeypatch.setattr(bot, 'BROADCAST_DELAY', 0)
+    for _ in range(bot.telegram_breaker.min_calls):
+        bot.telegram_breaker.record(False)
+    clock.now = bot.telegram_breaker.open_until
+    assert bot.telegram_breaker.allow()   # sinov o'rnini getUpdates egalladi
+
+    sent = []
+    def send_message(chat_id, text, reply_markup=None):
+        if not bot.telegram_breaker.allow():
+            return False
+        bot.telegram_breaker.record(True)
+        sent.append((chat_id, text))
+        return True
+    def sleep(seconds):
+        clock.now += seconds
+        if bot.telegram_breaker.probing:
+            bot.telegram_breaker.record(True)
+    monkeypatch.setattr(bot, 'send_message', send_message)
+    monkeypatch.setattr(bot.time, 'sleep', sleep)
+
+    data = make_data(bot)
+    bot.broadcast_message(1, {'type': 'text', 'text': "post"}, data)
+    assert sorted(chat for chat, text in sent if text == "post") == [10, 11, 12]
+    assert "Muvaffaqiyatli:</b> 3" in sent[-1][1]
+    assert "Xatolar:</b> 0" in sent[-1][1]
+
+def test_broadcast_retries_user_after_429(bot, clock, monkeypatch):
+    monkeypatch.setattr(bot, 'BROADCAST_DELAY', 0)
+    responses = {11: [FakeResponse(429, {'ok': False, 'parameters': {'retry_after': 3}})]}
+    sent, slept = [], []
+    def post(url, json=None, params=None, files=None, timeout=None):
+        chat_id = json['chat_id']
+        queue = responses.get(chat_id)
+        response = queue.pop(0) if queue else FakeResponse(200, {'ok': True})
+        if response.status_code == 200:
+            sent.append((chat_id, json['text']))
+        return response
+    monkeypatch.setattr(bot.requests, 'post', post)
+    monkeypatch.setattr(bot.time, 'sleep', slept.append)
+
+    bot.broadcast_message(1, {'type': 'text', 'text': "post"}, make_data(bot))
+    # Breaker yopiq qoldi, lekin 429 olgan user xato deb sanalmaydi
+    assert bot.telegram_breaker.is_closed()
+    assert sorted(chat for chat, text in sent if text == "post") == [10, 11, 12]
+    assert 3 in slept
+    assert "Muvaffaqiyatli:</b> 3" in sent[-1][1]
+    assert "Xatolar:</b> 0" in sent[-1][1]
+    assert "Telegram pauzasi:</b> 3s" in sent[-1][1]
+
+# flush_mongo - o'zgargan userlar buferi
+@pytest.fixture
+def mongo(bot, fake_db, monkeypatch):
+    monkeypatch.setattr(bot, 'mongo_connected', True)
+    monkeypatch.setattr(bot, 'users_col', fake_db['users'])
+    monkeypatch.setattr(bot, 'channels_col', fake_db['channels'])
+    return fake_db
+
+def make_data(bot, count=3):
+    now = bot.format_tashkent_time()
+    users = {str(i): {'id': i, 'first_name': f"User{i}", 'joined': now, 'last_active': now, 'message_count': 1}
+             for i in range(10, 10 + count)}
+    return {'users': users, 'channels': {}, 'admins': [1], 'messages': []}
+
+def test_flush_mongo_writes_only_dirty_users(bot, mongo):
+    data = make_data(bot)
+    bot.mark_users_dirty(['10', '12'])
+    assert bot.flush_mongo(data)
+    assert sorted(d['id'] for d in mongo['users'].find({})) == [10, 12]
+    assert not bot.pending_mongo_users
+
+def test_flush_mongo_keeps_dirty_users_on_failure(bot, mongo):
+    data = make_data(bot)
+    bot.mark_users_dirty(['10', '11'])
+    mongo['users'].fail = pymongo.errors.OperationFailure('yozib bo\'lmadi')
+    assert not bot.flush_mongo(data)
+    assert bot.pending_mongo_users == {'10', '11'}
+
+    mongo['users'].fail = None
+    assert bot.flush_mongo(data)
+    assert mongo['users'].count_documents({}) == 2
+    assert not bot.pending_mongo_users
+
+def test_flush_mongo_keeps_dirty_users_while_breaker_open(bot, mongo, clock):
+    data = make_data(bot)
+    bot.mark_users_dirty(['10'])
+    for _ in range(bot.mongo_breaker.min_calls):
+        bot.mongo_breaker.record(False)
+    assert not bot.flush_mongo(data)
+    assert bot.pending_mongo_users == {'10'}
+    assert mongo['users'].count_documents({}) == 0
+
+def test_flush_mongo_connection_error_switches_to_json(bot, mongo):
+    data = make_data(bot)
+    bot.mark_users_dirty(['10'])
+    mongo['users'].fail = pymongo.errors.AutoReconnect('uzildi')
+    assert not bot.flush_mongo(data)
+    assert not bot.mongo_connected
+    assert bot.pending_mongo_users == {'10'}
+    assert bot.mongo_stats['disconnects'] == 1
+
+def test_mark_users_dirty_overflow_schedules_resync(bot, mongo, monkeypatch):
+    monkeypatch.setattr(bot, 'MONGO_BUFFER_MAX', 2)
+    data = make_data(bot, count=4)
+    bot.mark_users_dirty(['10', '11', '12'])
+    assert bot.mongo_resync
+    assert not bot.pending_mongo_users
+    assert bot.mongo_stats['overflows'] == 1
+    assert bot.flush_mongo(data)
+    assert mongo['users'].count_documents({}) == 4
+    assert not bot.mongo_resync
+
+def test_flush_mongo_does_not_clobber_newer_mongo_values(bot, mongo):
+    mongo['users'].insert_one({'id': 10, 'first_name': 'Eski', 'joined': '2023-01-01 00:00:00',
+                               'last_active': '2099-01-01 00:00:00', 'message_count': 50})
+    data = make_data(bot, count=1)
+    bot.mark_users_dirty(['10'])
+    assert bot.flush_mongo(data)
+    doc, = mongo['users'].find({'id': 10})
+    assert doc['joined'] == '2023-01-01 00:00:00'
+    assert doc['last_active'] == '2099-01-01 00:00:00'
+    assert doc['message_count'] == 50
+    assert doc['first_name'] == 'User10'
+
+def test_mongo_client_has_socket_timeout(bot):
+    options = bot.mongo_client_options()
+    assert options['socketTimeoutMS'] == bot.MONGO_SOCKET_TIMEOUT_MS > 0
+
+def test_save_data_writes_mongo_outside_state_lock(bot, mongo, monkeypatch):
+    monkeypatch.setattr(bot, 'MONGO_BATCH_SIZE', 2)
+    data = make_data(bot)
+    bot.mark_users_dirty(['10', '11', '12'])
+    col = mongo['users']
+    write = col.bulk_write
+    lock_free, batches = [], []
+    def bulk_write(ops, ordered=True):
+        # Boshqa thread (handler) yozish paytida qulfni ola olishi kerak
+        def try_lock():
+            acquired = bot.state_lock.acquire(timeout=1)
+            if acquired:
+                bot.state_lock.release()
+            lock_free.append(acquired)
+        thread = bot.threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        batches.append(len(ops))
+        # Yozish paytida o'zgargan user buferda qolishi kerak
+        bot.mark_users_dirty(['11'])
+        return write(ops, ordered)
+    monkeypatch.setattr(col, 'bulk_write', bulk_write)
+
+    bot.save_data(data)
+    assert lock_free == [True, True]
+    assert sorted(batches) == [1, 2]
+    assert col.count_documents({}) == 3
+    assert bot.pending_mongo_users == {'11'}
+
+def test_flush_mongo_requeues_unwritten_batches(bot, mongo, monkeypatch):
+    monkeypatch.setattr(bot, 'MONGO_BATCH_SIZE', 1)
+    data = make_data(bot)
+    bot.mark_users_dirty(['10', '11', '12'])
+    col = mongo['users']
+    write = col.bulk_write
+    def bulk_write(ops, ordered=True):
+        if col.count_documents({}) == 1:
+            raise pymongo.errors.OperationFailure('yozib bo\'lmadi')
+        return write(ops, ordered)
+    monkeypatch.setattr(col, 'bulk_write', bulk_write)
+
+    assert not bot.flush_mongo(data)
+    written = {str(d['id']) for d in col.find({})}
+    assert len(written) == 1
+    assert bot.pending_mongo_users == {'10', '11', '12'} - written
+
+@pytest.mark.parametrize('batch_size', [1, 1000])
+def test_reconnect_merges_stale_json_with_mongo(bot, mongo, monkeypatch, batch_size):
+    monkeypatch.setattr(bot, 'MONGO_BATCH_SIZE', batch_size)
+    queries = []
+    find = mongo['users'].find
+    def recording_find(query=None, projection=None):
+        queries.append(query)
+        return find(query, projection)
+    monkeypatch.setattr(mongo['users'], 'find', recording_find)
+    # Ishga tushishda ping o'tmadi - xotirada eski users.json
+    monkeypatch.setattr(bot, 'mongo_connected', False)
+    monkeypatch.setattr(bot, 'mongo_resync', True)
+    monkeypatch.setattr(bot, 'mongo_reconnecting', True)
+    monkeypatch.setattr(bot, 'connect_mongo_collections', lambda: None)
+    monkeypatch.setattr(bot.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(bot, 'user_index', bot.UserIndex())
+    mongo['users'].insert_many([
+        {'id': 10, 'first_name': 'Yangi', 'username': 'yangi', 'joined': '2023-01-01 00:00:00',
+         'last_active': '2024-06-01 00:00:00', 'message_count': 50},
+        {'id': 20, 'first_name': 'Faqat', 'username': 'faqat_mongo', 'joined': '2023-02-01 00:00:00',
+         'last_active': '2024-06-01 00:00:00', 'message_count': 7},
+    ])
+    data = {'users': {
+        # Eski profil, lekin uzilish paytida yozgan - faollik yangiroq
+        '10': {'id': 10, 'first_name': 'Eski', 'username': 'eski', 'joined': '2024-01-01 00:00:00',
+               'last_active': '2024-07-01 00:00:00', 'message_count': 3, 'awaiting_user_search': True},
+        '30': {'id': 30, 'first_name': 'Uzilishda', 'joined': '2024-07-01 00:00:00',
+               'last_active': '2024-07-01 00:00:00', 'message_count': 1},
+    }, 'channels': {}, 'admins': [1], 'messages': []}
+    monkeypatch.setattr(bot, 'bot_data', data)
+
+    bot.mongo_reconnect_loop()
+    reconnect_queries = list(queries)
+
+    assert bot.mongo_connected
+    assert not bot.mongo_resync
+    docs = {d['id']: d for d in mongo['users'].find({})}
+    assert sorted(docs) == [10, 20, 30]
+    assert docs[10]['message_count'] == 50
+    assert docs[10]['joined'] == '2023-01-01 00:00:00'
+    assert docs[10]['last_active'] == '2024-07-01 00:00:00'
+    assert docs[20]['message_count'] == 7
+    # Xotira ham Mongo holatini ko'radi (statistika, segment, qidiruv)
+    assert data['users']['10']['message_count'] == 50
+    assert data['users']['10']['joined'] == '2023-01-01 00:00:00'
+    assert data['users']['10']['awaiting_user_search']
+    assert data['users']['20']['first_name'] == 'Faqat'
+    assert bot.user_index.username_prefix('faqat') == ['20']
+    assert bot.mongo_stats['reconnects'] == 1
+    # Butun kolleksiya xotiraga olinmaydi - to'liq yozuvlar faqat $in bo'laklari bilan o'qiladi
+    assert all(q and 'id' in q for q in reconnect_queries)
+    in_queries = [q['id']['$in'] for q in reconnect_queries if '$in' in q['id']]
+    assert sorted(uid for ids in in_queries for uid in ids) == [10, 20, 30]
+    assert all(len(ids) <= batch_size for ids in in_queries)
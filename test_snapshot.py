@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+def make_data():
+    users = {
+        '10': {'id': 10, 'first_name': 'Ali', 'joined': '2024-01-01 00:00:00',
+               'last_active': '2024-06-01 10:00:00', 'message_count': 3},
+        '11': {'id': 11, 'first_name': 'Vali', 'joined': '2024-02-01 00:00:00',
+               'last_active': '2024-06-02 10:00:00', 'message_count': 5},
+    }
+    messages = [{'user_id': 10, 'text': f"xabar {i}", 'date': '2024-06-01 10:00:00'} for i in range(150)]
+    return {'users': users, 'channels': {'kanal': {'username': 'kanal', 'name': 'Kanal'}},
+            'admins': [1], 'messages': messages}
+
+def age(path, seconds):
+    # Fayl vaqtini orqaga surish - mtime taqqoslashlari aniq bo'lsin
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+def test_snapshot_round_trip(bot):
+    data = make_data()
+    bot.mark_users_dirty(['11'])
+    assert bot.write_snapshot(data)
+    bot.pending_mongo_users.clear()
+
+    loaded = bot.load_snapshot()
+    assert loaded['users'] == data['users']
+    assert loaded['channels'] == data['channels']
+    assert loaded['admins'] == [1]
+    # Log MESSAGES_LOAD_LIMIT gacha qisqartiriladi (load_data bilan bir xil)
+    assert loaded['messages'] == data['messages'][-bot.MESSAGES_LOAD_LIMIT:]
+    # Mongo ga yetib bormagan yozuvlar qayta buferga tushadi
+    assert bot.pending_mongo_users == {'11'}
+
+def test_snapshot_version_mismatch_falls_back(bot):
+    assert bot.write_snapshot(make_data())
+    with open(bot.SNAPSHOT_FILE, 'rb') as f:
+        raw = bytearray(f.read())
+    raw[len(bot.SNAPSHOT_MAGIC)] = bot.SNAPSHOT_VERSION + 1
+    with open(bot.SNAPSHOT_FILE, 'wb') as f:
+        f.write(raw)
+    assert bot.load_snapshot() is None
+
+def test_snapshot_corrupt_body_falls_back(bot):
+    with open(bot.SNAPSHOT_FILE, 'wb') as f:
+        f.write(bot.SNAPSHOT_MAGIC + bytes([bot.SNAPSHOT_VERSION]) + b'buzilgan')
+    assert bot.load_snapshot() is None
+
+def test_snapshot_older_than_json_falls_back(bot):
+    data = make_data()
+    assert bot.write_snapshot(data)
+    age(bot.SNAPSHOT_FILE, 60)
+    bot.save_json(data['users'], bot.USERS_FILE)
+    assert bot.load_snapshot() is None
+
+def test_snapshot_uses_newer_message_log(bot):
+    data = make_data()
+    assert bot.write_snapshot(data)
+    # Snapshotdan keyin yozilgan xabarlar (jarayon SIGKILL bilan to'xtagan - yangi snapshot yo'q)
+    logged = data['messages'] + [{'user_id': 11, 'text': 'oxirgi', 'date': '2024-06-02 10:00:00'}]
+    bot.save_json(logged[-200:], bot.MESSAGES_FILE)
+
+    loaded = bot.load_snapshot()
+    assert loaded['messages'][-1]['text'] == 'oxirgi'
+    assert len(loaded['messages']) == bot.MESSAGES_LOAD_LIMIT
+
+@pytest.fixture
+def mongo(bot, fake_db, monkeypatch):
+    monkeypatch.setattr(bot, 'mongo_connected', True)
+    monkeypatch.setattr(bot, 'users_col', fake_db['users'])
+    monkeypatch.setattr(bot, 'channels_col', fake_db['channels'])
+    return fake_db
+
+def test_snapshot_catches_up_from_mongo_since_sync_point(bot, mongo):
+    data = make_data()
+    assert bot.write_snapshot(data)
+    mongo['users'].insert_many([
+        # sync_point (2024-06-02 10:00:00) dan oldingi - so'ralmaydi, snapshotdagi qiymat qoladi
+        {'id': 10, 'first_name': 'Eski', 'joined': '2024-01-01 00:00:00',
+         'last_active': '2024-05-01 00:00:00', 'message_count': 1},
+        {'id': 11, 'first_name': 'Vali', 'joined': '2024-01-15 00:00:00',
+         'last_active': '2024-06-03 09:00:00', 'message_count': 9},
+        {'id': 12, 'first_name': 'Yangi', 'joined': '2024-06-03 00:00:00',
+         'last_active': '2024-06-03 00:00:00', 'message_count': 1},
+    ])
+    mongo['channels'].insert_one({'username': 'boshqa', 'name': 'Boshqa'})
+
+    loaded = bot.load_snapshot()
+    assert loaded['users']['10']['first_name'] == 'Ali'
+    assert loaded['users']['11']['message_count'] == 9
+    assert loaded['users']['11']['joined'] == '2024-01-15 00:00:00'
+    assert loaded['users']['12']['first_name'] == 'Yangi'
+    assert set(loaded['channels']) == {'boshqa'}